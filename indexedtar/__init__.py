@@ -45,20 +45,38 @@ _tar_index.json data                                o
 [FILE_N_NAME, FILE_N_TINFO_OFFSET, FILE_N_DATA_OFFSET, FILE_N_SIZE]]
 ######
 """
+import os
+import sys
+import errno
+import fcntl
+import hashlib
 import tarfile
 import time
 import struct
 import fnmatch
+import mmap
 import re
 import io
 import json
+import queue
+import threading
 from pathlib import Path
 import tempfile
-from contextlib import contextmanager
-from typing import IO, Generator, Union
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import IO, Callable, Generator, NamedTuple, Optional, Union
 import logging
 
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel("INFO")
@@ -97,6 +115,490 @@ def set_and_restore(object, attr_name: str, value):
         setattr(object, attr_name, old)
 
 
+# errors meaning a kernel copy primitive does not support
+# this pair of file descriptors, we then try the next one
+_KERNEL_COPY_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSOCK,
+    errno.EOPNOTSUPP,
+    errno.ESPIPE,
+}
+
+COPY_BUFSIZE = 1024 ** 2
+
+
+def _kernel_copy_funcs(dst_fd: int):
+    """
+    Kernel copy primitives available for dst_fd as
+    func(src_fd, dst_fd, src_offset, count) -> copied
+    """
+    # copy_file_range fails with EBADF on O_APPEND destinations
+    if hasattr(os, "copy_file_range") and not (
+        fcntl.fcntl(dst_fd, fcntl.F_GETFL) & os.O_APPEND
+    ):
+        yield lambda src, dst, offset, count: os.copy_file_range(
+            src, dst, count, offset_src=offset
+        )
+    if hasattr(os, "sendfile"):
+        yield lambda src, dst, offset, count: os.sendfile(dst, src, offset, count)
+
+
+def copy_range(src: IO, offset: int, size: int, dst: Union[int, IO]) -> int:
+    """
+    Copies size bytes of src starting at offset to the current
+    position of dst, a file descriptor or a file object.
+    Uses os.copy_file_range or os.sendfile so the payload does
+    not go through user-space buffers, falls back to a chunked copy.
+    The position of src is left untouched.
+    """
+    if isinstance(dst, int):
+        dst_fd, dst_file = dst, None
+    elif not hasattr(dst, "write"):
+        # sockets and other objects only exposing a descriptor
+        dst_fd, dst_file = dst.fileno(), None
+    else:
+        dst_file = dst
+        try:
+            dst_fd = dst.fileno()
+            dst.flush()
+        except (AttributeError, OSError):
+            # io.UnsupportedOperation is an OSError
+            dst_fd = None
+
+    src_fd = src.fileno()
+    copied = 0
+    if dst_fd is not None:
+        for kernel_copy in _kernel_copy_funcs(dst_fd):
+            try:
+                while copied < size:
+                    n = kernel_copy(src_fd, dst_fd, offset + copied, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                break
+            except OSError as ose:
+                if ose.errno not in _KERNEL_COPY_FALLBACK_ERRNOS:
+                    raise
+                logger.debug(f"Kernel copy failed with {ose}, trying next method")
+
+        # the kernel moved the file offset behind the back of the file object
+        if dst_file is not None and copied and dst_file.seekable():
+            dst_file.seek(os.lseek(dst_fd, 0, os.SEEK_CUR))
+
+    while copied < size:
+        chunk = os.pread(src_fd, min(COPY_BUFSIZE, size - copied), offset + copied)
+        if not chunk:
+            break
+        if dst_file is None:
+            written = 0
+            while written < len(chunk):
+                written += os.write(dst_fd, chunk[written:])
+        else:
+            dst_file.write(chunk)
+        copied += len(chunk)
+
+    if isinstance(src, _CountingFile):
+        src.count_read(copied)
+
+    if copied != size:
+        raise tarfile.ReadError("unexpected end of data")
+    return copied
+
+
+def _pread(fd: int, size: int, offset: int) -> bytes:
+    """
+    os.pread of size bytes at offset, looping over short reads
+    (Linux reads at most 0x7ffff000 bytes per call). Returns
+    less than size bytes only when the end of file is reached.
+    """
+    chunks = list()
+    read = 0
+    while read < size:
+        chunk = os.pread(fd, size - read, offset + read)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        read += len(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+def _pack_segment(segment: Path, filepaths: list) -> tuple:
+    """
+    Worker side of parallel creation: packs files into a tar segment
+    and returns its partial index, offsets relative to the segment start,
+    and mtimes, along with the segment end (end of archive blocks excluded)
+    """
+    index = list()
+    mtimes = list()
+    with tarfile.open(segment, mode="x", format=tarfile.PAX_FORMAT) as tf:
+        for filepath in filepaths:
+            tinfo_offset = tf.offset
+            tinfo = tf.gettarinfo(filepath)
+            data_offset = tinfo_offset + len(
+                tinfo.tobuf(tf.format, tf.encoding, tf.errors)
+            )
+            with open(filepath, "rb") as src:
+                tf.addfile(tinfo, fileobj=src)
+            index.append((tinfo.name, tinfo_offset, data_offset, tinfo.size))
+            mtimes.append(tinfo.mtime)
+        end = tf.offset
+    return index, mtimes, end
+
+
+def _partition(filepaths: list, parts: int) -> list:
+    """
+    Splits filepaths into at most parts contiguous
+    partitions of similar total size
+    """
+    sizes = [f.stat().st_size for f in filepaths]
+    target = max(sum(sizes) / parts, 1)
+    partitions = [[]]
+    total = 0
+    for filepath, size in zip(filepaths, sizes):
+        if total >= target * len(partitions) and len(partitions) < parts:
+            partitions.append([])
+        partitions[-1].append(filepath)
+        total += size
+    return [x for x in partitions if x]
+
+
+class _BloomFilter:
+    """
+    Bloom filter over member names, serialized as its
+    bit count and hash count followed by its bits
+    """
+
+    _header_struct = struct.Struct(">QB")
+
+    def __init__(self, nbits: int, nhashes: int, bits: bytearray = None):
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.bits = bytearray(-(-nbits // 8)) if bits is None else bits
+
+    @classmethod
+    def for_capacity(cls, count: int, bits_per_name: int = 10):
+        """
+        About 1% false positives with 10 bits and 7 hashes per name
+        """
+        return cls(max(64, count * bits_per_name), 7)
+
+    def _positions(self, name: str) -> Generator[int, None, None]:
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, name: str):
+        for position in self._positions(name):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, name: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(name)
+        )
+
+    def tobytes(self) -> bytes:
+        return self._header_struct.pack(self.nbits, self.nhashes) + bytes(self.bits)
+
+    @classmethod
+    def frombytes(cls, data: bytes):
+        nbits, nhashes = cls._header_struct.unpack_from(data)
+        bits = bytearray(data)
+        del bits[: cls._header_struct.size]
+        return cls(nbits, nhashes, bits)
+
+
+class IndexEntry(NamedTuple):
+    """
+    One member of the index
+    """
+
+    name: str
+    tinfo_offset: int
+    data_offset: int
+    size: int
+
+
+class IndexedTarStats:
+    """
+    Opt-in I/O counters and latency histograms
+    collected by an IndexedTar.
+    The optional callback is invoked with (operation, seconds)
+    for each timed operation, e.g. to feed a metrics exporter.
+    Updates are thread safe, e.g. for the ReadScheduler workers.
+    """
+
+    # upper bounds in seconds of the latency histogram buckets
+    latency_buckets = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, float("inf"))
+
+    def __init__(self, callback: Optional[Callable[[str, float], None]] = None):
+        self.counters = Counter()
+        self.latencies = dict()
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def incr(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def observe(self, operation: str, seconds: float):
+        """
+        Records one latency sample of operation
+        """
+        with self._lock:
+            histogram = self.latencies.setdefault(
+                operation,
+                {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "buckets": [0] * len(self.latency_buckets),
+                },
+            )
+            histogram["count"] += 1
+            histogram["total"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+            for i, upper_bound in enumerate(self.latency_buckets):
+                if seconds <= upper_bound:
+                    histogram["buckets"][i] += 1
+                    break
+
+        if self.callback is not None:
+            self.callback(operation, seconds)
+
+    @contextmanager
+    def timed(self, operation: str):
+        """
+        Times the wrapped block as one sample of operation
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "latency": {
+                    operation: dict(
+                        histogram,
+                        buckets=dict(zip(self.latency_buckets, histogram["buckets"])),
+                    )
+                    for operation, histogram in self.latencies.items()
+                },
+            }
+
+
+class _CountingFile:
+    """
+    File object proxy counting seeks, reads
+    and bytes read on behalf of IndexedTarStats
+    """
+
+    def __init__(self, fileobj: IO, stats: IndexedTarStats):
+        self._fileobj = fileobj
+        self._stats = stats
+
+    def seek(self, *args):
+        self._stats.incr("seeks")
+        return self._fileobj.seek(*args)
+
+    def read(self, *args):
+        data = self._fileobj.read(*args)
+        self.count_read(len(data))
+        return data
+
+    def count_read(self, size: int):
+        """
+        Accounts for a read done on our descriptor
+        without going through read(), e.g. by copy_range
+        """
+        self._stats.incr("reads")
+        self._stats.incr("bytes_read", size)
+
+    def __getattr__(self, name: str):
+        return getattr(self._fileobj, name)
+
+
+class ReadScheduler:
+    """
+    Serves concurrent read requests on a file in offset order.
+    Pending requests are queued sorted by offset and dispatched in
+    one way elevator order (C-SCAN) from the last offset read, requests
+    closer than merge_gap bytes are merged into one read of at most
+    max_read bytes. queue_depth worker threads issue the reads with
+    os.pread, each request gets a Future of its bytes.
+    """
+
+    def __init__(
+        self,
+        fileobj: IO,
+        queue_depth: int = 4,
+        merge_gap: int = 0,
+        max_read: int = 16 * COPY_BUFSIZE,
+    ):
+        if queue_depth < 1:
+            raise ValueError(f"{queue_depth=} must be at least 1")
+
+        self._fileobj = fileobj
+        self._fd = fileobj.fileno()
+        self._merge_gap = merge_gap
+        self._max_read = max_read
+        # (offset, sequence, size, future) sorted by offset
+        self._pending = list()
+        self._sequence = 0
+        self._head = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(queue_depth)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, offset: int, size: int) -> Future:
+        """
+        Queues the read of size bytes at offset
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit reads to a closed ReadScheduler")
+            insort(self._pending, (offset, self._sequence, size, future))
+            self._sequence += 1
+            self._condition.notify()
+        return future
+
+    def _next_batch(self) -> list:
+        """
+        Pops the next pending request in elevator order
+        along with the requests it can be merged with
+        """
+        i = bisect_left(self._pending, (self._head,))
+        if i == len(self._pending):
+            # end of the sweep, back to the lowest offset
+            i = 0
+        batch = [self._pending.pop(i)]
+        start, end = batch[0][0], batch[0][0] + batch[0][2]
+        while i < len(self._pending):
+            offset, _, size, _ = self._pending[i]
+            if offset > end + self._merge_gap or offset + size - start > self._max_read:
+                break
+            batch.append(self._pending.pop(i))
+            end = max(end, offset + size)
+        self._head = end
+        return batch
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = self._next_batch()
+
+            batch = [x for x in batch if x[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = batch[0][0]
+            end = max(offset + size for offset, _, size, _ in batch)
+            try:
+                data = _pread(self._fd, end - start, start)
+            except OSError as ose:
+                for _, _, _, future in batch:
+                    future.set_exception(ose)
+                continue
+
+            if isinstance(self._fileobj, _CountingFile):
+                self._fileobj.count_read(len(data))
+            view = memoryview(data)
+            for offset, _, size, future in batch:
+                chunk_start, chunk_end = offset - start, offset - start + size
+                chunk = view[chunk_start:chunk_end]
+                if len(chunk) != size:
+                    future.set_exception(tarfile.ReadError("unexpected end of data"))
+                else:
+                    future.set_result(bytes(chunk))
+
+    def close(self):
+        """
+        Serves the pending requests and stops the workers
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def _digest(fileobj: IO) -> str:
+    """
+    Content digest used to dedupe payloads
+    """
+    h = hashlib.blake2b()
+    for chunk in iter(lambda: fileobj.read(COPY_BUFSIZE), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+class _HashingReader:
+    """
+    Read-only file object proxy digesting
+    the bytes read through it
+    """
+
+    def __init__(self, fileobj: IO):
+        self._fileobj = fileobj
+        self._hash = hashlib.blake2b()
+
+    def read(self, *args):
+        data = self._fileobj.read(*args)
+        self._hash.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class _IndexedTarFile(tarfile.TarFile):
+    """
+    TarFile extracting regular members with copy_range
+    and resolving hard links through our index
+    """
+
+    # set by IndexedTar: (linkname, link tar header offset) -> target tar header offset
+    resolve_link = None
+
+    def _find_link_target(self, tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+        if tarinfo.islnk() and self.resolve_link is not None:
+            target_offset = self.resolve_link(tarinfo.linkname, tarinfo.offset)
+            if target_offset is not None:
+                with set_and_restore(self, "offset", target_offset):
+                    return self.next()
+        return super()._find_link_target(tarinfo)
+
+    def makefile(self, tarinfo: tarfile.TarInfo, targetpath: str):
+        if tarinfo.sparse is not None:
+            return super().makefile(tarinfo, targetpath)
+
+        with open(targetpath, "wb") as target:
+            copy_range(self.fileobj, tarinfo.offset_data, tarinfo.size, target)
+
+
 class IndexedTar:
     """
     This class provides incremental tar members
@@ -109,14 +611,47 @@ class IndexedTar:
     _allowed_tar_modes = ("r:", "x:", "a:")
     _index_filename = "_tar_index.json"
     _header_filename = "_tar_offset.bin"
+    _columns_filename = "_tar_columns.bin"
+    _columns_pax_key = "indexed_tar_columns"
+    _filter_filename = "_tar_filter.bin"
+    _filter_pax_key = "indexed_tar_filter"
     _header_struct = struct.Struct(">QQQ")
     _index_pax_key = "index_seek_offset"
     _header_offset_in_tar = None
+    _index_header_offset = None
+    _columns_offset = None
+    _filter_location = None
     _version = "1.0.1"
 
-    def __init__(self, filepath: Path, mode: str = "r:") -> None:
+    def __init__(
+        self,
+        filepath: Path,
+        mode: str = "r:",
+        stats: bool = False,
+        stats_callback: Optional[Callable[[str, float], None]] = None,
+        dedupe_content: bool = False,
+        columns: bool = False,
+        membership_filter: bool = False,
+        align: int = 0,
+        read_queue_depth: int = 0,
+    ) -> None:
         """
-        We open the archive in read-only or write-only
+        We open the archive in read-only or write-only.
+        Set stats to True (or supply a stats_callback) to collect
+        I/O counters and latency histograms, see IndexedTar.stats()
+        Set dedupe_content to True to store payloads identical to one
+        added during this session as tar hard links to it.
+        Set columns to True to store mtime and size columns along
+        with the index, see IndexedTar.query(). Archives already
+        carrying columns keep them when appended to.
+        Set membership_filter to True to store a Bloom filter of the
+        member names, see IndexedTar.contains(). Archives already
+        carrying one keep it when appended to.
+        Set align (a multiple of 512, e.g. 4096) to pad the pax headers of
+        the members added so that their data offsets are multiples of align,
+        for O_DIRECT reads and page aligned mmaps, see IndexedTar.mmap_member().
+        Set read_queue_depth to serve IndexedTar.read_member() requests of
+        concurrent threads through a ReadScheduler with that many workers.
         """
 
         if mode not in self._allowed_tar_modes:
@@ -124,29 +659,51 @@ class IndexedTar:
                 f"Requested {mode=} is not supported (must be in {self._allowed_tar_modes})"
             )
 
+        if align % tarfile.BLOCKSIZE:
+            raise IndexedTarException(
+                f"Requested {align=} is not a multiple of {tarfile.BLOCKSIZE}"
+            )
+
         self._mode = mode
+        self._align = align
+        self._index_entries = None
+        self._index_size = 0
+        self._filter = None
+        # digest -> (name, data offset, size) of stored payloads
+        self._digests = dict() if dedupe_content else None
+        self._digest_by_name = dict()
+        self._digested_sizes = set()
+        # mtime column as an array('d') aligned with the index, None if not loaded
+        self._mtimes = None
+        self._sizes = None
+        self._stats = (
+            IndexedTarStats(stats_callback)
+            if stats or stats_callback is not None
+            else None
+        )
 
         if mode in ("r:", "a:"):
 
             # In append mode we first have to open the tar file in
             # read mode to extract the existing index
             if mode == "a:":
-                with tarfile.TarFile(filepath, mode="r") as tf:
+                with self._open_tarfile(filepath, "r:") as tf:
                     self._index, self._header_offset_in_tar = self.extract_index(tf)
 
-                self._tarfile = tarfile.open(
+                self._tarfile = self._open_tarfile(
                     filepath, mode=mode, format=tarfile.PAX_FORMAT
                 )
 
             else:
-                self._tarfile = tarfile.open(
+                self._tarfile = self._open_tarfile(
                     filepath, mode=mode, format=tarfile.PAX_FORMAT
                 )
 
-                self._index, _ = self.extract_index(self._tarfile)
+                # the index itself is loaded on first use
+                self._header_offset_in_tar = self._read_index_header(self._tarfile)
 
         else:
-            self._tarfile = tarfile.open(
+            self._tarfile = self._open_tarfile(
                 filepath,
                 mode=mode,
                 format=tarfile.PAX_FORMAT,
@@ -154,11 +711,93 @@ class IndexedTar:
             )
             self._init_header()
             self._index = list()
+            # mtimes are only tracked for the columns
+            self._mtimes = array("d") if columns else None
+
+        self._write_columns = columns or self._columns_offset is not None
+        self._write_filter = membership_filter or self._filter_location is not None
+        if mode == "a:" and self._write_columns:
+            self._mtimes = self._mtime_column()
+
+        self._tarfile.resolve_link = self._link_target_offset
+        self._opened_offset = self._tarfile.offset
+        self._replaced = False
+        self._scheduler = (
+            ReadScheduler(self._tarfile.fileobj, read_queue_depth)
+            if read_queue_depth
+            else None
+        )
+
+    def _open_tarfile(self, filepath: Path, mode: str, **kwargs) -> tarfile.TarFile:
+        """
+        Opens the underlying TarFile, through a _CountingFile
+        when stats are enabled so that every seek and read is counted,
+        including the ones of the index load.
+        """
+        if self._stats is None:
+            return _IndexedTarFile.open(filepath, mode=mode, **kwargs)
+
+        fileobj = _CountingFile(
+            open(filepath, {"r:": "rb", "a:": "r+b", "x:": "xb"}[mode]), self._stats
+        )
+        try:
+            tf = _IndexedTarFile.open(filepath, mode=mode, fileobj=fileobj, **kwargs)
+        except BaseException:
+            fileobj.close()
+            raise
+
+        # the TarFile owns our file object and closes it on close
+        tf._extfileobj = False
+        return tf
+
+    def _timed(self, operation: str):
+        """
+        Times operation when stats are enabled
+        """
+        return self._stats.timed(operation) if self._stats else nullcontext()
 
     def extract_index(self, tf: tarfile.TarFile) -> list:
         """
         Extracts the index from TarFile
         """
+        header_offset = self._read_index_header(tf)
+        return self._read_index(tf.fileobj), header_offset
+
+    @property
+    def _index(self) -> list:
+        """
+        The index, read archives load it on first use
+        """
+        if self._index_entries is None:
+            self._index_entries = self._read_index(self._tarfile.fileobj)
+        return self._index_entries
+
+    @_index.setter
+    def _index(self, value: list):
+        self._index_entries = value
+
+    def _read_index(self, fileobj: IO) -> list:
+        """
+        Reads and parses the index json located by _read_index_header
+        """
+        with self._timed("index_load"):
+            logger.debug(
+                f"Reading index json at {self._index_offset} of len {self._index_size}"
+            )
+            with seek_at_and_restore(fileobj, self._index_offset):
+                index = json.loads(fileobj.read(self._index_size).decode("utf-8"))
+
+        if self._stats is not None:
+            self._stats.incr("index_bytes", self._index_size)
+            self._stats.incr("index_entries", len(index))
+        return index
+
+    def _read_index_header(self, tf: tarfile.TarFile) -> int:
+        """
+        Reads our header and the index tar header, with the pax records
+        locating the optional columns and membership filter.
+        Returns the header offset.
+        """
         filepath = Path(tf.name)
         if "indexed_tar" not in tf.pax_headers:
             raise IndexedTarException(
@@ -193,6 +832,11 @@ class IndexedTar:
             except OSError as ose:
                 raise IndexedTarException("Corrupt header") from ose
 
+            if tinfo is None:
+                raise IndexedTarException(
+                    f"No index tar header found at {index_tar_header_offset}"
+                )
+
             if tinfo.name != self._index_filename:
                 raise IndexedTarException(
                     f"Invalid index filename, got {tinfo.name}, expected {self._index_filename}"
@@ -203,11 +847,21 @@ class IndexedTar:
                     "Inconsistency between index size in tar header and indexedtar header, file has been corrupted ?"
                 )
 
-        logger.debug(f"Reading index json at {index_offset} of len {index_size}")
-        with seek_at_and_restore(tf.fileobj, index_offset):
-            raw_index = tf.fileobj.read(index_size).decode("utf-8")
+            columns_offset = tinfo.pax_headers.get(self._columns_pax_key)
+            self._columns_offset = (
+                None if columns_offset is None else int(columns_offset)
+            )
+            filter_location = tinfo.pax_headers.get(self._filter_pax_key)
+            self._filter_location = (
+                None
+                if filter_location is None
+                else tuple(int(x) for x in filter_location.split())
+            )
 
-        return json.loads(raw_index), header_offset
+        self._index_offset = index_offset
+        self._index_size = index_size
+        self._index_header_offset = index_tar_header_offset
+        return header_offset
 
     def _init_header(self):
         """
@@ -254,17 +908,109 @@ class IndexedTar:
             )
 
         logger.debug(f"Adding {filepath} to {self._tarfile.name}")
+        with self._timed("add"):
+            tinfo = self._tarfile.gettarinfo(filepath, arcname=arcname)
+            with open(filepath, "rb") as src:
+                self._addfile(tinfo, src)
+
+    def _addfile(self, tinfo: tarfile.TarInfo, fileobj: IO):
+        """
+        Writes a regular member and indexes it. When deduping, a payload
+        identical to one already stored is written as a hard link member
+        whose index entry points at the original payload.
+        """
         tinfo_offset = self._tarfile.offset
-        tinfo = self._tarfile.gettarinfo(filepath, arcname=arcname)
+        if self._digests is None:
+            if self._align:
+                self._align_data(tinfo, tinfo_offset)
+            data_offset = tinfo_offset + self._get_tarinfo_size(tinfo)
+            self._tarfile.addfile(tinfo, fileobj=fileobj)
+            self._index.append((tinfo.name, tinfo_offset, data_offset, tinfo.size))
+            self._append_mtime(tinfo.mtime)
+            return
+
+        # a hard link must not point to a name we are about to shadow
+        self._digests.pop(self._digest_by_name.pop(tinfo.name, None), None)
+
+        # only payloads of an already stored size can be duplicates,
+        # the others are digested while being written
+        digest = None
+        if tinfo.size in self._digested_sizes:
+            digest = _digest(fileobj)
+            fileobj.seek(0)
+            if digest in self._digests:
+                name, data_offset, size = self._digests[digest]
+                logger.debug(f"{tinfo.name} payload is identical to {name}")
+                tinfo.type = tarfile.LNKTYPE
+                tinfo.linkname = name
+                tinfo.size = 0
+                self._tarfile.addfile(tinfo)
+                self._index.append((tinfo.name, tinfo_offset, data_offset, size))
+                self._append_mtime(tinfo.mtime)
+                if self._stats is not None:
+                    self._stats.incr("deduped_members")
+                    self._stats.incr("deduped_bytes", size)
+                return
+
+        if self._align:
+            self._align_data(tinfo, tinfo_offset)
         data_offset = tinfo_offset + self._get_tarinfo_size(tinfo)
-        with open(filepath, "rb") as src:
-            self._tarfile.addfile(tinfo, fileobj=src)
+        reader = fileobj if digest is not None else _HashingReader(fileobj)
+        self._tarfile.addfile(tinfo, fileobj=reader)
         self._index.append((tinfo.name, tinfo_offset, data_offset, tinfo.size))
+        self._append_mtime(tinfo.mtime)
+        digest = digest if digest is not None else reader.hexdigest()
+        if digest not in self._digests:
+            self._digests[digest] = (tinfo.name, data_offset, tinfo.size)
+            self._digest_by_name[tinfo.name] = digest
+        self._digested_sizes.add(tinfo.size)
 
-    def add_dir(self, dir2archive: Path, recurse=False):
+    def _align_data(self, tinfo: tarfile.TarInfo, tinfo_offset: int):
+        """
+        Pads the pax header of tinfo with a comment record,
+        ignored by tar readers, so that its data offset is aligned
+        """
+        header_size = self._get_tarinfo_size(tinfo)
+        if (tinfo_offset + header_size) % self._align == 0:
+            return
+
+        tinfo.pax_headers = dict(tinfo.pax_headers, comment="")
+        target = tinfo_offset + self._get_tarinfo_size(tinfo)
+        target += -target % self._align
+        while True:
+            # header size grows by whole blocks with the comment length,
+            # look for the shortest comment reaching our target
+            low, high = 0, target - tinfo_offset
+            while low < high:
+                middle = (low + high) // 2
+                tinfo.pax_headers["comment"] = " " * middle
+                if tinfo_offset + self._get_tarinfo_size(tinfo) < target:
+                    low = middle + 1
+                else:
+                    high = middle
+            tinfo.pax_headers["comment"] = " " * low
+            if tinfo_offset + self._get_tarinfo_size(tinfo) == target:
+                return
+            target += self._align
+
+    def _append_mtime(self, mtime: float):
+        if self._mtimes is not None:
+            self._mtimes.append(mtime)
+
+    def _link_target_offset(self, linkname: str, link_offset: int) -> Optional[int]:
+        """
+        Tar header offset of the last member named linkname
+        before the hard link at link_offset
+        """
+        for name, tinfo_offset, _, _ in reversed(self._index):
+            if name == linkname and tinfo_offset < link_offset:
+                return tinfo_offset
+        return None
+
+    def add_dir(self, dir2archive: Path, recurse=False, jobs: int = 1):
         """
         Adds a directory content, optionaly descending
-        into subdirs
+        into subdirs, see add_files for jobs
         """
         if not dir2archive.is_dir():
             raise IndexedTarException(f"{dir2archive} MUST be a dir")
@@ -274,14 +1020,330 @@ class IndexedTar:
                 f"Cannot add files to read only IndexedTar {self._tarfile}"
             )
 
-        if recurse:
-            for f in dir2archive.rglob("*"):
-                if f.is_file():
-                    self.add(f)
+        files = dir2archive.rglob("*") if recurse else dir2archive.iterdir()
+        self.add_files([f for f in files if f.is_file()], jobs=jobs)
+
+    def add_files(self, filepaths: list, jobs: int = 1):
+        """
+        Adds files to the archive. With jobs > 1, worker processes
+        each pack a contiguous partition of the files into a tar segment,
+        segments are then concatenated by range copy and their
+        partial indexes rebased into ours.
+        """
+        if jobs <= 1 or len(filepaths) < 2 or self._digests is not None or self._align:
+            if jobs > 1 and (self._digests is not None or self._align):
+                logger.warning(
+                    "Content dedupe and alignment require a sequential add, ignoring jobs"
+                )
+            for f in filepaths:
+                self.add(f)
+            return
+
+        if self._mode not in ("x:", "a:"):
+            raise IndexedTarException(
+                f"Cannot add files to read only IndexedTar {self._tarfile}"
+            )
+
+        for f in filepaths:
+            if not f.is_file():
+                raise IndexedTarException(
+                    f"only files can be added to an IndexedTar, {f} is not a file."
+                )
+
+        partitions = _partition(filepaths, jobs)
+        logger.debug(f"Packing {len(filepaths)} files in {len(partitions)} segments")
+
+        # segments live next to the archive so that copy_file_range
+        # stays on the same filesystem
+        with tempfile.TemporaryDirectory(
+            dir=Path(self._tarfile.name).parent
+        ) as td, ProcessPoolExecutor(len(partitions)) as pool:
+            segments = [Path(td) / f"segment_{i}.tar" for i in range(len(partitions))]
+            futures = [
+                pool.submit(_pack_segment, segment, partition)
+                for segment, partition in zip(segments, partitions)
+            ]
+            for segment, future in zip(segments, futures):
+                index, mtimes, end = future.result()
+                with self._timed("add"), open(segment, "rb") as src:
+                    self._add_region(src, 0, end, index, mtimes)
+
+    def _members_region(self) -> tuple:
+        """
+        Returns the (start, end) offsets of the region holding our members:
+        from the first member after the header file up to the index tar header
+        """
+        if self._index_header_offset is None:
+            raise IndexedTarException("Members region is only known for read archives")
+
+        header_blocks = -(-self._header_struct.size // tarfile.BLOCKSIZE)
+        start = self._header_offset_in_tar + header_blocks * tarfile.BLOCKSIZE
+        return start, self._index_header_offset
+
+    def add_archive(self, src: Path):
+        """
+        Appends all the members of another IndexedTar by copying
+        its members region as one range and rebasing its index
+        by a constant offset, no tar header is parsed.
+        """
+        if self._mode not in ("x:", "a:"):
+            raise IndexedTarException(
+                f"Cannot add an archive to read only IndexedTar {self._tarfile}"
+            )
+
+        with self._timed("add"), IndexedTar(src) as it:
+            start, end = it._members_region()
+            logger.debug(f"Copying {src} members region [{start}, {end})")
+            mtimes = it._mtime_column() if self._mtimes is not None else None
+            self._add_region(it._tarfile.fileobj, start, end, it._index, mtimes)
+
+    def _add_region(
+        self, src: IO, start: int, end: int, index: list, mtimes: list = None
+    ):
+        """
+        Copies the [start, end) range of src holding whole tar members
+        at our current offset and adds its index rebased accordingly.
+        mtimes of the region members keep our mtime column up to date.
+        """
+        delta = self._tarfile.offset - start
+        copy_range(src, start, end - start, self._tarfile.fileobj)
+        self._tarfile.offset += end - start
+        self._index.extend(
+            (name, tinfo_offset + delta, data_offset + delta, size)
+            for name, tinfo_offset, data_offset, size in index
+        )
+        if self._mtimes is not None:
+            if mtimes is None:
+                self._mtimes = None
+            else:
+                self._mtimes.extend(mtimes)
+
+    def dedupe_names(self):
+        """
+        Keeps only the latest index entry of each member name.
+        Payloads of shadowed members remain in the tar.
+        """
+        positions = self._latest_positions()
+        if self._mtimes is not None:
+            self._mtimes = array("d", (self._mtimes[i] for i in positions))
+        self._index = [self._index[i] for i in positions]
+
+    def _latest_positions(self) -> list:
+        """
+        Positions of the index entries not shadowed by
+        a later member of the same name, in index order
+        """
+        seen = set()
+        latest = list()
+        for position in range(len(self._index) - 1, -1, -1):
+            name = self._index[position][0]
+            if name not in seen:
+                seen.add(name)
+                latest.append(position)
+        return latest[::-1]
+
+    def _latest_entries(self) -> list:
+        """
+        Index entries shadowed by a later member of
+        the same name removed, index order preserved
+        """
+        return [self._index[i] for i in self._latest_positions()]
+
+    @classmethod
+    def merge(cls, sources: list, dest: Path, mode: str = "x:", dedupe=False):
+        """
+        Merges IndexedTar sources into dest, created (x:) or appended to (a:),
+        by range copies of their members. Set dedupe to True to keep only
+        the latest member of each name across the sources.
+        """
+        with cls(dest, mode=mode) as it:
+            for src in sources:
+                logger.info(f"Merging {src} into {dest}")
+                it.add_archive(src)
+            if dedupe:
+                it.dedupe_names()
+
+    def add_tar_stream(self, fileobj: IO, bufsize: int = COPY_BUFSIZE):
+        """
+        Appends the members of a plain tar stream (a pipe, stdin, possibly
+        compressed) read once, in order, headers and payloads being copied
+        in bufsize chunks. Regular members are indexed, hard links to them
+        are indexed at their target payload. Other members (directories,
+        symlinks...) are kept in the tar but not indexed. The internal
+        members of an IndexedTar stream are skipped.
+        """
+        if self._mode not in ("x:", "a:"):
+            raise IndexedTarException(
+                f"Cannot add a tar stream to read only IndexedTar {self._tarfile}"
+            )
+
+        reserved = (
+            self._header_filename,
+            self._index_filename,
+            self._columns_filename,
+            self._filter_filename,
+        )
+        with tarfile.open(
+            fileobj=fileobj, mode="r|*", bufsize=bufsize
+        ) as src, set_and_restore(self._tarfile, "copybufsize", bufsize):
+            for tinfo in src:
+                if tinfo.name in reserved:
+                    continue
+
+                # parsed pax headers include the global ones of the stream
+                for key, value in src.pax_headers.items():
+                    if tinfo.pax_headers.get(key) == value:
+                        del tinfo.pax_headers[key]
+
+                with self._timed("add"):
+                    if tinfo.isreg():
+                        payload = src.extractfile(tinfo)
+                        if tinfo.issparse():
+                            self._unsparse(tinfo)
+                        if self._digests is not None:
+                            # content dedupe reads payloads twice
+                            spooled = tempfile.SpooledTemporaryFile(bufsize)
+                            for chunk in iter(lambda: payload.read(bufsize), b""):
+                                spooled.write(chunk)
+                            spooled.seek(0)
+                            payload = spooled
+                        with payload:
+                            self._addfile(tinfo, payload)
+                    else:
+                        self._add_unindexed(tinfo)
+
+    @staticmethod
+    def _unsparse(tinfo: tarfile.TarInfo):
+        """
+        Turns a sparse member, whose payload we read expanded,
+        into a regular one of the same (real) size
+        """
+        tinfo.type = tarfile.REGTYPE
+        tinfo.sparse = None
+        for key in list(tinfo.pax_headers):
+            # the path record of pax sparse members is a placeholder
+            if key.startswith("GNU.sparse.") or key == "path":
+                del tinfo.pax_headers[key]
+
+    def _add_unindexed(self, tinfo: tarfile.TarInfo):
+        """
+        Writes a payload less member, a hard link to one
+        of our members is indexed at the target payload
+        """
+        tinfo_offset = self._tarfile.offset
+        self._tarfile.addfile(tinfo)
+        target = self._get_latest_entry(tinfo.linkname) if tinfo.islnk() else None
+        if target is not None:
+            _, _, data_offset, size = target
+            self._index.append((tinfo.name, tinfo_offset, data_offset, size))
+            self._append_mtime(tinfo.mtime)
+
+    @classmethod
+    def from_tar_stream(cls, fileobj: IO, dest: Path, mode: str = "x:", **kwargs):
+        """
+        Converts a plain tar stream into the IndexedTar dest, created (x:)
+        or appended to (a:) with kwargs options, see add_tar_stream
+        """
+        with cls(dest, mode=mode, **kwargs) as it:
+            it.add_tar_stream(fileobj)
+
+    def _read_tarinfo(self, tinfo_offset: int) -> tarfile.TarInfo:
+        """
+        Parses the tar header at tinfo_offset without
+        moving the write position of the archive
+        """
+        # TarFile.next() is not available in append mode
+        fileobj = self._tarfile.fileobj
+        with set_and_restore(
+            self._tarfile, "offset", tinfo_offset
+        ), seek_at_and_restore(fileobj, tinfo_offset):
+            return self._tarfile.tarinfo.fromtarfile(self._tarfile)
+
+    def _read_columns(self, column: int, typecode: str) -> array:
+        """
+        Reads one column of the _tar_columns.bin member,
+        little endian arrays of mtimes (d) then sizes (Q)
+        """
+        values = array(typecode)
+        count = len(self._index)
+        offset = self._columns_offset + column * count * values.itemsize
+        with seek_at_and_restore(self._tarfile.fileobj, offset):
+            values.frombytes(self._tarfile.fileobj.read(count * values.itemsize))
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def _mtime_column(self) -> array:
+        """
+        Returns the mtime column, read from the stored columns
+        or, when the archive has none, from the tar headers
+        """
+        if self._mtimes is None:
+            if self._columns_offset is not None:
+                self._mtimes = self._read_columns(0, "d")
+            else:
+                logger.info(f"No mtime column in {self._tarfile.name}, reading headers")
+                self._mtimes = array(
+                    "d", (self._read_tarinfo(x[1]).mtime for x in self._index)
+                )
+        return self._mtimes
+
+    def _size_column(self) -> array:
+        """
+        Returns the size column, cached for read only archives
+        """
+        if self._sizes is not None and self._mode == "r:":
+            return self._sizes
+        if self._columns_offset is not None and self._mode == "r:":
+            self._sizes = self._read_columns(1, "Q")
         else:
-            for f in dir2archive.iterdir():
-                if f.is_file():
-                    self.add(f)
+            self._sizes = array("Q", (x[3] for x in self._index))
+        return self._sizes
+
+    def query(
+        self,
+        mtime_range: tuple = None,
+        size_range: tuple = None,
+        name_prefix: str = None,
+    ) -> list:
+        """
+        Returns the index entries whose mtime and size fall within
+        [low, high) ranges (either bound may be None) and whose name
+        starts with name_prefix, filtering on columns without tar header I/O
+        when the archive carries them. Vectorized with numpy if available.
+        """
+        with self._timed("query"):
+            filters = list()
+            if mtime_range is not None:
+                filters.append((self._mtime_column(), mtime_range))
+            if size_range is not None:
+                filters.append((self._size_column(), size_range))
+
+            if numpy is not None:
+                mask = numpy.ones(len(self._index), dtype=bool)
+                for column, (low, high) in filters:
+                    values = numpy.frombuffer(column, dtype=column.typecode)
+                    if low is not None:
+                        mask &= values >= low
+                    if high is not None:
+                        mask &= values < high
+                positions = numpy.flatnonzero(mask).tolist()
+            else:
+                positions = [
+                    i
+                    for i in range(len(self._index))
+                    if all(
+                        (low is None or column[i] >= low)
+                        and (high is None or column[i] < high)
+                        for column, (low, high) in filters
+                    )
+                ]
+
+            return [
+                IndexEntry._make(self._index[i])
+                for i in positions
+                if name_prefix is None or self._index[i][0].startswith(name_prefix)
+            ]
 
     def getmember_at_index(self, index: int) -> tarfile.TarInfo:
         """
@@ -311,16 +1373,35 @@ class IndexedTar:
         Internal generator over members matching
         a match_func return value
         """
-        idx_gen = (
-            (x for x in self._index)
-            if do_reversed
-            else (x for x in reversed(self._index))
-        )
+        idx_gen = reversed(self._index) if do_reversed else iter(self._index)
+
+        if self._stats is None:
+            for mname, m_info_offset, _, _ in idx_gen:
+                if match_func(mname):
+                    self._tarfile.offset = m_info_offset
+                    yield self._tarfile.next()
+            return
 
-        for mname, m_info_offset, _, _ in idx_gen:
-            if match_func(mname):
-                self._tarfile.offset = m_info_offset
-                yield self._tarfile.next()
+        # instrumented path: time spent between matches is reported
+        # as one lookup, excluding the time the caller holds the member.
+        # The scan after the last match (or of a miss) is a lookup too.
+        start = time.perf_counter()
+        scanning = True
+        try:
+            for mname, m_info_offset, _, _ in idx_gen:
+                self._stats.incr("members_scanned")
+                if match_func(mname):
+                    self._tarfile.offset = m_info_offset
+                    tinfo = self._tarfile.next()
+                    self._stats.incr("members_matched")
+                    self._stats.observe("lookup", time.perf_counter() - start)
+                    scanning = False
+                    yield tinfo
+                    start = time.perf_counter()
+                    scanning = True
+        finally:
+            if scanning:
+                self._stats.observe("lookup", time.perf_counter() - start)
 
     def get_members_fnmatching(
         self, pattern: str, do_reversed: bool = False
@@ -346,16 +1427,130 @@ class IndexedTar:
             lambda x: reobj.match(x) is not None, do_reversed
         )
 
+    def get_entries_fnmatching(
+        self, pattern: str, do_reversed: bool = False, latest_only: bool = False
+    ) -> Generator[IndexEntry, None, None]:
+        """
+        Generator of index entries matching a fnmatch pattern,
+        answered from the index alone without reading any tar header.
+        Set latest_only to True to skip members shadowed by a later
+        member of the same name.
+        """
+        reobj = re.compile(fnmatch.translate(pattern))
+        entries = self._latest_entries() if latest_only else self._index
+        for entry in reversed(entries) if do_reversed else entries:
+            if reobj.match(entry[0]) is not None:
+                yield IndexEntry._make(entry)
+
+    def iter_all(
+        self,
+        with_data: bool = True,
+        latest_only: bool = False,
+        chunk_size: int = 16 * COPY_BUFSIZE,
+    ) -> Generator[tuple, None, None]:
+        """
+        Generator of (IndexEntry, payload) of all the members in data offset
+        order, for full sequential scans. Payloads are read ahead by a
+        background thread in chunks of about chunk_size bytes, two chunks
+        being buffered (double buffering) so that processing overlaps with
+        I/O. Payloads are read only memoryviews of the chunks, None when
+        with_data is False.
+        """
+        entries = self._latest_entries() if latest_only else self._index
+        entries = sorted((IndexEntry._make(x) for x in entries), key=lambda x: x[2])
+        if not with_data:
+            yield from ((entry, None) for entry in entries)
+            return
+
+        fd = self._tarfile.fileobj.fileno()
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        chunks = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=self._read_ahead,
+            args=(fd, self._chunk_entries(entries, chunk_size), chunks, stop),
+            daemon=True,
+        )
+        reader.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                start, group, data = chunk
+                if isinstance(self._tarfile.fileobj, _CountingFile):
+                    self._tarfile.fileobj.count_read(len(data))
+                view = memoryview(data).toreadonly()
+                for entry in group:
+                    entry_start = entry.data_offset - start
+                    yield entry, view[entry_start:][: entry.size]
+        finally:
+            stop.set()
+            # unblock the reader waiting for room in the queue
+            while reader.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+            # the descriptor is shared with our other readers
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NORMAL)
+
+    @staticmethod
+    def _chunk_entries(entries: list, chunk_size: int) -> Generator[list, None, None]:
+        """
+        Groups data offset sorted entries into runs
+        spanning about chunk_size bytes
+        """
+        group = list()
+        for entry in entries:
+            if (
+                group
+                and entry.data_offset + entry.size - group[0].data_offset > chunk_size
+            ):
+                yield group
+                group = list()
+            group.append(entry)
+        if group:
+            yield group
+
+    @staticmethod
+    def _read_ahead(fd: int, groups: Generator, chunks: queue.Queue, stop):
+        """
+        Reads each group of entries as a single chunk, queued
+        as (offset, entries, bytes), then None once done
+        """
+        try:
+            for group in groups:
+                start = group[0].data_offset
+                end = max(x.data_offset + x.size for x in group)
+                data = _pread(fd, end - start, start)
+                if len(data) != end - start:
+                    raise tarfile.ReadError("unexpected end of data")
+                if stop.is_set():
+                    return
+                chunks.put((start, group, data))
+            chunks.put(None)
+        except BaseException as e:
+            chunks.put(e)
+
     def extract_members(
         self, members: list, path: Path = Path("."), numeric_owner=False
     ):
         """
         Extracts members into dstdir.
         Same risks and limitations as in python TarFile.
+        Regular files payloads are copied with copy_range.
         """
-        self._tarfile.extractall(
-            path=path, members=members, numeric_owner=numeric_owner
-        )
+        with self._timed("extract"):
+            self._tarfile.extractall(
+                path=path, members=members, numeric_owner=numeric_owner
+            )
 
     def close(self):
         """
@@ -363,42 +1558,285 @@ class IndexedTar:
         the index offset and finally closes the tar archive
         """
 
+        with self._timed("close"):
+            self._close()
+
+    def _close(self):
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+
         if self._mode in ("x:", "a:"):
 
             if self._header_offset_in_tar is None:
                 raise IndexedTarException("Cannot close this archive")
 
             logger.debug(f"Closing IndexedTar {self._tarfile.name}")
-            with tempfile.NamedTemporaryFile("r+b") as tmp:
-                index_json = json.dumps(self._index).encode("utf-8")
-                tmp.write(index_json)
-                tmp.flush()
-                tmp.seek(0)
-                tinfo = self._tarfile.gettarinfo(tmp.name, arcname=self._index_filename)
-                tar_header_offset = self._tarfile.offset
-                data_offset = self._tarfile.offset + self._get_tarinfo_size(tinfo)
-                self._tarfile.addfile(tinfo, fileobj=tmp)
-
-                # now we need to seek at the beginning of the archive and write our
-                # header file pointing to this index
-
-                logger.debug(
-                    f"Overwriting header at {self._header_offset_in_tar} with {(data_offset, tinfo.size)}"
-                )
-                with seek_at_and_restore(
-                    self._tarfile.fileobj, self._header_offset_in_tar
-                ):
-                    self._tarfile.fileobj.write(
-                        self._header_struct.pack(
-                            tar_header_offset, data_offset, tinfo.size
-                        )
-                    )
-                self._tarfile.fileobj.flush()
+            if self._rewrite_index_in_place():
+                # nothing was appended, the end of archive blocks are still there
+                self._tarfile.mode = "r"
+            else:
+                self._append_index()
 
         if self._tarfile:
             self._tarfile.close()
         self._tarfile = None
 
+    def _append_index(self):
+        """
+        Writes the columns, filter and index members
+        and points our header to the new index
+        """
+        pax_headers = dict()
+        if self._write_columns:
+            pax_headers[self._columns_pax_key] = str(self._add_columns())
+        if self._write_filter:
+            pax_headers[self._filter_pax_key] = "{} {}".format(*self._add_filter())
+
+        with tempfile.NamedTemporaryFile("r+b") as tmp:
+            index_json = json.dumps(self._index).encode("utf-8")
+            tmp.write(index_json)
+            tmp.flush()
+            tmp.seek(0)
+            tinfo = self._tarfile.gettarinfo(tmp.name, arcname=self._index_filename)
+            tinfo.pax_headers = pax_headers
+            tar_header_offset = self._tarfile.offset
+            data_offset = self._tarfile.offset + self._get_tarinfo_size(tinfo)
+            self._tarfile.addfile(tinfo, fileobj=tmp)
+
+            # now we need to seek at the beginning of the archive and write our
+            # header file pointing to this index
+
+            logger.debug(
+                f"Overwriting header at {self._header_offset_in_tar} with {(data_offset, tinfo.size)}"
+            )
+            with seek_at_and_restore(self._tarfile.fileobj, self._header_offset_in_tar):
+                self._tarfile.fileobj.write(
+                    self._header_struct.pack(tar_header_offset, data_offset, tinfo.size)
+                )
+            self._tarfile.fileobj.flush()
+
+    def _columns_payload(self) -> bytes:
+        """
+        Serializes the mtime and size columns
+        """
+        mtimes = array("d", self._mtime_column())
+        sizes = array("Q", (x[3] for x in self._index))
+        if sys.byteorder == "big":
+            mtimes.byteswap()
+            sizes.byteswap()
+        return mtimes.tobytes() + sizes.tobytes()
+
+    def _add_columns(self) -> int:
+        """
+        Writes the mtime and size columns member,
+        returns its data offset
+        """
+        payload = self._columns_payload()
+
+        tinfo = tarfile.TarInfo(self._columns_filename)
+        tinfo.size = len(payload)
+        tinfo.mtime = time.time()
+        data_offset = self._tarfile.offset + self._get_tarinfo_size(tinfo)
+        self._tarfile.addfile(tinfo, fileobj=io.BytesIO(payload))
+        return data_offset
+
+    def _rewrite_index_in_place(self) -> bool:
+        """
+        When members were only replaced in place, overwrites the
+        current index (and columns) instead of appending a new one.
+        Returns False when a new index must be appended.
+        """
+        if (
+            self._mode != "a:"
+            or not self._replaced
+            or self._tarfile.offset != self._opened_offset
+            or self._index_offset + self._padded_size(self._index_size)
+            > self._opened_offset
+        ):
+            return False
+
+        index_json = json.dumps(self._index).encode("utf-8")
+        if len(index_json) > self._padded_size(self._index_size):
+            return False
+
+        if self._columns_offset is not None:
+            with seek_at_and_restore(self._tarfile.fileobj, self._columns_offset):
+                self._tarfile.fileobj.write(self._columns_payload())
+
+        try:
+            self._overwrite_member(
+                self._index_header_offset,
+                self._index_offset,
+                self._index_size,
+                index_json,
+                last=True,
+            )
+        except IndexedTarException as ite:
+            logger.debug(f"Cannot rewrite the index in place: {ite}")
+            return False
+
+        logger.debug(f"Rewrote index in place at {self._index_offset}")
+        # a: mode wrote a global pax header past the index on open,
+        # restore the end of archive blocks it replaced
+        index_end = self._index_offset + self._padded_size(self._index_size)
+        with seek_at_and_restore(self._tarfile.fileobj, index_end):
+            self._tarfile.fileobj.write(bytes(self._opened_offset - index_end))
+        with seek_at_and_restore(self._tarfile.fileobj, self._header_offset_in_tar):
+            self._tarfile.fileobj.write(
+                self._header_struct.pack(
+                    self._index_header_offset, self._index_offset, len(index_json)
+                )
+            )
+        self._tarfile.fileobj.flush()
+        return True
+
+    @staticmethod
+    def _padded_size(size: int) -> int:
+        return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+    def _overwrite_member(
+        self,
+        tinfo_offset: int,
+        data_offset: int,
+        size: int,
+        payload: bytes,
+        last: bool = False,
+    ):
+        """
+        Overwrites a member payload and the size field of its tar header,
+        the new payload must fit within the blocks of the old one,
+        blocks left over are filled with a pax header tar readers skip,
+        or zeroed for the last member of the archive
+        """
+        if len(payload) > self._padded_size(size):
+            raise IndexedTarException(
+                f"{len(payload)} bytes do not fit in the {self._padded_size(size)} bytes of the member"
+            )
+
+        tinfo = self._read_tarinfo(tinfo_offset)
+        # parsed pax headers include the global ones, only keep the member ones
+        for key in list(self._tarfile.pax_headers) + ["size"]:
+            tinfo.pax_headers.pop(key, None)
+        tinfo.size = len(payload)
+        header = tinfo.tobuf(
+            self._tarfile.format, self._tarfile.encoding, self._tarfile.errors
+        )
+        if len(header) != data_offset - tinfo_offset:
+            raise IndexedTarException(
+                f"Tar header of {tinfo.name} would change size, cannot overwrite it"
+            )
+
+        fileobj = self._tarfile.fileobj
+        with seek_at_and_restore(fileobj, tinfo_offset):
+            fileobj.write(header)
+            fileobj.write(payload)
+            fileobj.write(bytes(self._padded_size(len(payload)) - len(payload)))
+            freed = self._padded_size(size) - self._padded_size(len(payload))
+            if freed:
+                fileobj.write(bytes(freed) if last else self._filler(freed))
+
+    @staticmethod
+    def _filler(size: int) -> bytes:
+        """
+        Pax extended header of size bytes holding a comment record,
+        tar readers skip it along with the next member header. Keeps
+        the archive walkable when a replaced payload needs fewer blocks.
+        """
+        records = b""
+        length = size - tarfile.BLOCKSIZE
+        if length:
+            # the record length counts its own digits
+            padding = length - len(str(length)) - len(" comment=\n")
+            records = b"%d comment=%s\n" % (length, b" " * padding)
+        tinfo = tarfile.TarInfo("././@PaxHeader")
+        tinfo.type = tarfile.XHDTYPE
+        tinfo.size = len(records)
+        return tinfo.tobuf(tarfile.USTAR_FORMAT, "ascii") + records
+
+    def replace(self, name: str, data: bytes):
+        """
+        Overwrites in place the payload of the latest member named name,
+        provided data fits within the 512 bytes blocks of the current payload.
+        Only the tar header size field and the index entry are updated,
+        the archive does not grow. Requires the a: mode.
+        """
+        if self._mode != "a:":
+            raise IndexedTarException(
+                f"Members can only be replaced in a: mode, not {self._mode}"
+            )
+
+        with self._timed("replace"):
+            position = next(
+                (
+                    i
+                    for i in range(len(self._index) - 1, -1, -1)
+                    if self._index[i][0] == name
+                ),
+                None,
+            )
+            if position is None:
+                raise IndexedTarException(f"No member named {name}")
+
+            _, tinfo_offset, data_offset, size = self._index[position]
+            if self._read_tarinfo(tinfo_offset).offset_data != data_offset or any(
+                x[2] == data_offset for i, x in enumerate(self._index) if i != position
+            ):
+                raise IndexedTarException(
+                    f"Payload of {name} is shared with other members, cannot replace it"
+                )
+
+            self._overwrite_member(tinfo_offset, data_offset, size, data)
+            self._index[position] = (name, tinfo_offset, data_offset, len(data))
+            if self._digests is not None:
+                self._digests.pop(self._digest_by_name.pop(name, None), None)
+            self._replaced = True
+
+    def _add_filter(self) -> tuple:
+        """
+        Writes the membership filter member,
+        returns its data offset and size
+        """
+        bloom = _BloomFilter.for_capacity(len(self._index))
+        for name, _, _, _ in self._index:
+            bloom.add(name)
+        payload = bloom.tobytes()
+
+        tinfo = tarfile.TarInfo(self._filter_filename)
+        tinfo.size = len(payload)
+        tinfo.mtime = time.time()
+        data_offset = self._tarfile.offset + self._get_tarinfo_size(tinfo)
+        self._tarfile.addfile(tinfo, fileobj=io.BytesIO(payload))
+        return data_offset, tinfo.size
+
+    def contains(self, name: str) -> bool:
+        """
+        Tells whether a member is named name. When the archive carries
+        a membership filter, a negative answer costs one small read
+        and the index is neither read nor parsed.
+        """
+        if name in (self._index_filename, self._header_filename):
+            return False
+
+        if (
+            self._index_entries is None
+            and self._filter_location is not None
+            and self._mode == "r:"
+        ):
+            with self._timed("lookup"):
+                if self._filter is None:
+                    offset, size = self._filter_location
+                    with seek_at_and_restore(self._tarfile.fileobj, offset):
+                        self._filter = _BloomFilter.frombytes(
+                            self._tarfile.fileobj.read(size)
+                        )
+                if name not in self._filter:
+                    if self._stats is not None:
+                        self._stats.incr("filter_negatives")
+                    return False
+
+        return self._get_latest_entry(name) is not None
+
     def __enter__(self):
         if self._tarfile and not self._tarfile.closed:
             return self
@@ -420,7 +1858,162 @@ class IndexedTar:
                 f"Cannot extract {member}, must be an instance of str or TarInfo"
             )
 
-        return self._tarfile.extractfile(tinfo)
+        # payload reads happen later through the returned file object,
+        # only the header resolution is timed here
+        with self._timed("extractfile_open"):
+            return self._tarfile.extractfile(tinfo)
+
+    def copy_member_to(
+        self,
+        member: Union[str, tarfile.TarInfo, IndexEntry],
+        dst: Union[int, IO],
+        start: int = 0,
+        length: int = None,
+    ) -> int:
+        """
+        Copies the payload of a member to dst, a file descriptor or a
+        file object (files, sockets, pipes...) straight from the data offset
+        of the index, using os.copy_file_range or os.sendfile when possible.
+        `member' may be a filename (latest member of that name), a TarInfo
+        or an IndexEntry. Set start and length to copy a part of the payload.
+        Returns the number of bytes copied.
+        """
+        offset, length = self._member_range(member, start, length)
+        with self._timed("copy"):
+            return copy_range(self._tarfile.fileobj, offset, length, dst)
+
+    def read_member(
+        self,
+        member: Union[str, tarfile.TarInfo, IndexEntry],
+        start: int = 0,
+        length: int = None,
+    ) -> Future:
+        """
+        Reads the payload of a member, or a part of it, see copy_member_to,
+        returns a Future of its bytes. With a read_queue_depth, the reads
+        requested by concurrent threads are reordered by offset and merged
+        by our ReadScheduler, otherwise the read is done right away.
+        """
+        offset, length = self._member_range(member, start, length)
+        if self._scheduler is not None:
+            return self._scheduler.submit(offset, length)
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._timed("read"):
+            data = _pread(self._tarfile.fileobj.fileno(), length, offset)
+        if isinstance(self._tarfile.fileobj, _CountingFile):
+            self._tarfile.fileobj.count_read(len(data))
+        if len(data) != length:
+            future.set_exception(tarfile.ReadError("unexpected end of data"))
+        else:
+            future.set_result(data)
+        return future
+
+    def _member_range(
+        self,
+        member: Union[str, tarfile.TarInfo, IndexEntry],
+        start: int = 0,
+        length: int = None,
+    ) -> tuple:
+        """
+        Returns the (offset, length) in the archive of the range [start, start + length)
+        of a member payload, checking it lies within the member and the archive
+        """
+        if isinstance(member, IndexEntry):
+            name, _, data_offset, size = member
+        elif isinstance(member, str):
+            entry = self._get_latest_entry(member)
+            if entry is None:
+                raise IndexedTarException(f"No member named {member}")
+            name, _, data_offset, size = entry
+        elif isinstance(member, tarfile.TarInfo):
+            if member.islnk():
+                member = self._tarfile._find_link_target(member)
+            name, data_offset, size = member.name, member.offset_data, member.size
+        else:
+            raise IndexedTarException(
+                f"Cannot read {member}, must be an instance of str, TarInfo or IndexEntry"
+            )
+
+        if not isinstance(member, str):
+            archive_size = os.fstat(self._tarfile.fileobj.fileno()).st_size
+            if data_offset < 0 or size < 0 or data_offset + size > archive_size:
+                raise IndexedTarException(
+                    f"Member {name} data is outside of {self._tarfile.name}"
+                )
+
+        length = size - start if length is None else length
+        if start < 0 or length < 0 or start + length > size:
+            raise IndexedTarException(
+                f"Range [{start}, {start + length}) is outside of member {name}"
+            )
+
+        return data_offset + start, length
+
+    def mmap_member(self, name: str) -> memoryview:
+        """
+        Returns a read only memoryview of the payload of the latest member
+        named name, backed by a mmap. For archives written with align set to
+        a multiple of the page size, the mapping starts at the data offset.
+        """
+        entry = self._get_latest_entry(name)
+        if entry is None:
+            raise IndexedTarException(f"No member named {name}")
+
+        _, _, data_offset, size = entry
+        if size == 0:
+            return memoryview(b"")
+
+        skip = data_offset % mmap.ALLOCATIONGRANULARITY
+        start = data_offset - skip
+        mapping = mmap.mmap(
+            self._tarfile.fileobj.fileno(),
+            data_offset + size - start,
+            offset=start,
+            access=mmap.ACCESS_READ,
+        )
+        return memoryview(mapping)[skip:]
+
+    def _get_latest_entry(self, name: str) -> Optional[tuple]:
+        """
+        Returns the last index entry named name
+        """
+        if name in (self._index_filename, self._header_filename):
+            raise IndexedTarException(f"filename {name} is reserved")
+
+        for entry in reversed(self._index):
+            if entry[0] == name:
+                return entry
+        return None
+
+    def stats(self) -> dict:
+        """
+        Returns the shape of the index along with the
+        I/O counters and latency histograms collected
+        when the archive was opened with stats enabled.
+        """
+        sizes = [x[3] for x in self._index]
+        shape = {
+            "entries": len(self._index),
+            "unique_names": len(set(x[0] for x in self._index)),
+            "payload_bytes": sum(sizes),
+            "min_member_size": min(sizes, default=0),
+            "max_member_size": max(sizes, default=0),
+            "index_bytes": self._index_size,
+            "columns": self._columns_offset is not None,
+        }
+
+        if self._stats is None:
+            return {"index": shape, "counters": {}, "latency": {}, "derived": {}}
+
+        derived = dict()
+        counters = self._stats.counters
+        if counters["members_matched"]:
+            derived["members_scanned_per_match"] = (
+                counters["members_scanned"] / counters["members_matched"]
+            )
+        return dict(self._stats.as_dict(), index=shape, derived=derived)
 
     def __exit__(self, type, value, traceback):
         self.close()
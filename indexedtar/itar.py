@@ -4,7 +4,10 @@ work with IndexedTar
 """
 from pathlib import Path
 import argparse
+import json
+import sys
 from indexedtar import IndexedTar, logger
+from indexedtar.server import IndexedTarHTTPServer
 
 
 class IndexedTarCliException(Exception):
@@ -15,9 +18,15 @@ parser = argparse.ArgumentParser(description="IndexedTar build/extract utility."
 parser.add_argument(
     "action",
     type=str,
-    help='action to perform: "x" for extract, "l" for listing, "c" for create, "a" for append',
+    help='action to perform: "x" for extract, "l" for listing, "c" for create, "a" for append, '
+    '"stats" for index shape and load statistics, '
+    '"merge" to merge the --target archives into archive, "serve" to serve archive members over HTTP, '
+    '"convert" to convert the --target tar (stdin by default) into archive',
 )
 parser.add_argument("archive", type=Path, help="path to archive file")
+parser.add_argument(
+    "more_archives", type=Path, nargs="*", help="serve: additional archives"
+)
 parser.add_argument(
     "--target", type=Path, help="file or directory to add", action="append"
 )
@@ -27,12 +36,65 @@ parser.add_argument(
     help="fnmatch filter for listing/extracting archive members",
     default="*",
 )
+parser.add_argument(
+    "--long",
+    action="store_true",
+    help="listing: also print size, tar header and data offsets",
+)
+parser.add_argument(
+    "--json",
+    action="store_true",
+    help="listing: print one json object per member (NDJSON)",
+)
+parser.add_argument(
+    "--count", action="store_true", help="listing: only print the members count"
+)
+parser.add_argument(
+    "--latest-only",
+    action="store_true",
+    help="listing: skip members shadowed by a later member of the same name",
+)
+parser.add_argument(
+    "--align",
+    type=int,
+    help="create/append/convert: align member data offsets on this many bytes, e.g. 4096",
+    default=0,
+)
+parser.add_argument(
+    "--jobs",
+    type=int,
+    help="create/append: number of worker processes packing the targets",
+    default=1,
+)
+parser.add_argument(
+    "--dedupe-content",
+    action="store_true",
+    help="create/append/convert: store identical payloads once, repeats as tar hard links",
+)
+parser.add_argument(
+    "--dedupe",
+    action="store_true",
+    help="merge: keep only the latest member of each name across archives",
+)
+parser.add_argument(
+    "--host", type=str, help="serve: address to listen on", default="127.0.0.1"
+)
+parser.add_argument("--port", type=int, help="serve: port to listen on", default=8000)
+parser.add_argument(
+    "--threads", type=int, help="serve: size of the request thread pool", default=8
+)
+parser.add_argument(
+    "--idle-timeout",
+    type=float,
+    help="serve: seconds after which idle keep-alive connections are closed",
+    default=30.0,
+)
 parser.add_argument(
     "--output_dir", type=str, help="output directory for extraction", default=Path(".")
 )
 
 
-ALLOWED_ACTIONS = ("x", "l", "c", "a")
+ALLOWED_ACTIONS = ("x", "l", "c", "a", "stats", "merge", "serve", "convert")
 
 
 def main(test_override: list = None):
@@ -51,18 +113,37 @@ def main(test_override: list = None):
 
     if action == "l":
         with IndexedTar(args.archive) as it:
-            for m in it.get_members_fnmatching(args.fnmatch_filter):
-                print(f"{m.name}")
+            entries = it.get_entries_fnmatching(
+                args.fnmatch_filter, latest_only=args.latest_only
+            )
+            if args.count:
+                print(sum(1 for _ in entries))
+            elif args.json:
+                sys.stdout.writelines(f"{json.dumps(e._asdict())}\n" for e in entries)
+            elif args.long:
+                sys.stdout.writelines(
+                    f"{e.size:>12} {e.tinfo_offset:>14} {e.data_offset:>14} {e.name}\n"
+                    for e in entries
+                )
+            else:
+                sys.stdout.writelines(f"{e.name}\n" for e in entries)
 
     elif action in ("c", "a"):
         mode = {"c": "x:", "a": "a:"}[action]
-        with IndexedTar(args.archive, mode=mode) as it:
+        with IndexedTar(
+            args.archive,
+            mode=mode,
+            dedupe_content=args.dedupe_content,
+            align=args.align,
+        ) as it:
+            files = list()
             for f in args.target:
                 logger.info(f"Adding {str(f)} to {args.archive}")
                 if f.is_file():
-                    it.add(f)
+                    files.append(f)
                 elif f.is_dir():
-                    it.add_dir(f, recurse=True)
+                    files.extend(x for x in f.rglob("*") if x.is_file())
+            it.add_files(files, jobs=args.jobs)
 
     elif action == "x":
         with IndexedTar(args.archive) as it:
@@ -73,6 +154,51 @@ def main(test_override: list = None):
                 it.get_members_fnmatching(args.fnmatch_filter), path=args.output_dir
             )
 
+    elif action == "merge":
+        if not args.target:
+            raise IndexedTarCliException("merge requires at least one --target")
+        IndexedTar.merge(args.target, args.archive, dedupe=args.dedupe)
+
+    elif action == "convert":
+        if args.target and len(args.target) > 1:
+            raise IndexedTarCliException("convert takes at most one --target")
+        kwargs = dict(dedupe_content=args.dedupe_content, align=args.align)
+        if args.target:
+            with open(args.target[0], "rb") as src:
+                IndexedTar.from_tar_stream(src, args.archive, **kwargs)
+        else:
+            IndexedTar.from_tar_stream(sys.stdin.buffer, args.archive, **kwargs)
+
+    elif action == "serve":
+        server = IndexedTarHTTPServer(
+            (args.host, args.port),
+            [args.archive] + args.more_archives,
+            threads=args.threads,
+            idle_timeout=args.idle_timeout,
+        )
+        logger.info(f"Serving on http://{args.host}:{server.server_address[1]}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    elif action == "stats":
+        with IndexedTar(args.archive, stats=True) as it:
+            stats = it.stats()
+            for key, value in stats["index"].items():
+                print(f"{key}: {value}")
+            for key, value in stats["counters"].items():
+                print(f"{key}: {value}")
+            for key, value in stats["derived"].items():
+                print(f"{key}: {value:.2f}")
+            for operation, histogram in stats["latency"].items():
+                print(
+                    f"{operation}_seconds: {histogram['total']:.6f} "
+                    f"(count={histogram['count']}, max={histogram['max']:.6f})"
+                )
+
 
 if __name__ == "__main__":
     main()
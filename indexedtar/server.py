@@ -0,0 +1,184 @@
+"""
+HTTP server exposing the members
+of IndexedTar archives
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+import json
+import mimetypes
+import re
+from indexedtar import IndexedTar, logger
+
+
+_range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class IndexedTarRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET / lists the members (NDJSON), ?fnmatch=<pattern> filters them.
+    GET /<member> serves the latest member of that name from the first
+    archive holding it, honouring single byte ranges.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # idle keep-alive connections must not hold a pool thread forever
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        url = urlsplit(self.path)
+        name = unquote(url.path).lstrip("/")
+        if not name:
+            pattern = parse_qs(url.query).get("fnmatch", ["*"])[0]
+            return self._send_listing(pattern, send_body)
+
+        found = self.server.lookup(name)
+        if found is None:
+            return self.send_error(HTTPStatus.NOT_FOUND, f"No member named {name}")
+        it, entry = found
+
+        start, length = 0, entry.size
+        status = HTTPStatus.OK
+        if "Range" in self.headers:
+            byte_range = self._parse_range(self.headers["Range"], entry.size)
+            if byte_range is None:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{entry.size}")
+                self.send_header("Content-Length", "0")
+                return self.end_headers()
+            start, length = byte_range
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        self.send_response(status)
+        self.send_header(
+            "Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream"
+        )
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{start + length - 1}/{entry.size}"
+            )
+        self.end_headers()
+
+        if send_body and length:
+            # headers must reach the socket before sendfile writes to it
+            self.wfile.flush()
+            # sendfile needs a blocking socket, the timeout is for idle connections
+            self.connection.settimeout(None)
+            try:
+                it.copy_member_to(entry, self.connection, start=start, length=length)
+            finally:
+                self.connection.settimeout(self.timeout)
+
+    @staticmethod
+    def _parse_range(header: str, size: int):
+        """
+        Parses a single byte range into (start, length),
+        None if it cannot be satisfied
+        """
+        match = _range_re.match(header.strip())
+        if match is None or match.groups() == ("", ""):
+            return None
+
+        first, last = match.groups()
+        if not first:
+            # suffix range: the last bytes
+            length = min(int(last), size)
+            return (size - length, length) if length else None
+
+        start = int(first)
+        end = size - 1 if not last else min(int(last), size - 1)
+        if start >= size or end < start:
+            return None
+        return start, end - start + 1
+
+    def _send_listing(self, pattern: str, send_body: bool):
+        body = "".join(
+            json.dumps(dict(entry._asdict(), archive=str(archive))) + "\n"
+            for archive, entry in self.server.entries(pattern)
+        ).encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class IndexedTarHTTPServer(HTTPServer):
+    """
+    HTTPServer handling requests in a thread pool. Archives are kept
+    open and their latest entries cached by name for the server lifetime.
+    Keep-alive connections idle for idle_timeout seconds are closed.
+    """
+
+    def __init__(
+        self,
+        server_address: tuple,
+        archives: list,
+        threads: int = 8,
+        idle_timeout: float = 30.0,
+    ):
+        self.idle_timeout = idle_timeout
+        self._archives = list()
+        self._entries = list()
+        for archive in archives:
+            it = IndexedTar(Path(archive))
+            self._archives.append((Path(archive), it))
+            self._entries.append(
+                {e.name: e for e in it.get_entries_fnmatching("*", latest_only=True)}
+            )
+        self._pool = ThreadPoolExecutor(threads)
+        super().__init__(server_address, IndexedTarRequestHandler)
+
+    def lookup(self, name: str):
+        """
+        Returns (IndexedTar, IndexEntry) of the first
+        archive holding name, None otherwise
+        """
+        for (_, it), entries in zip(self._archives, self._entries):
+            entry = entries.get(name)
+            if entry is not None:
+                return it, entry
+        return None
+
+    def entries(self, pattern: str):
+        """
+        Generator of (archive path, IndexEntry) matching
+        a fnmatch pattern
+        """
+        for archive, it in self._archives:
+            for entry in it.get_entries_fnmatching(pattern, latest_only=True):
+                yield archive, entry
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_in_pool, request, client_address)
+
+    def _process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+        for _, it in self._archives:
+            it.close()
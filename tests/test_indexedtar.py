@@ -1,7 +1,16 @@
+import io
+import os
+import shutil
+import socket
+import subprocess
 import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import tempfile
+from unittest import mock
 import pytest
+import indexedtar
 from indexedtar import IndexedTar, IndexedTarException
 
 
@@ -210,3 +219,759 @@ def test_edge_cases(ithelper, arpege_grib2: Path):
             with pytest.raises(IndexedTarException):
                 with (it) as itt:
                     itt.get_members_fnmatching("*")
+
+
+def test_stats(ithelper, arome_grib2: Path):
+    """
+    Opt-in counters and latency histograms
+    """
+    no_files: int = 3
+    observed = []
+    with ithelper.build_indexedtarfile(no_files) as itar_path:
+        with IndexedTar(itar_path) as it:
+            # stats disabled: only the index shape is reported
+            stats = it.stats()
+            assert stats["index"]["entries"] == no_files
+            assert stats["index"]["unique_names"] == no_files
+            assert stats["counters"] == {}
+
+        with IndexedTar(
+            itar_path, stats_callback=lambda op, sec: observed.append(op)
+        ) as it:
+            index_load_reads = it.stats()["counters"]["reads"]
+            tinfo = next(it.get_members_by_name("1_arome.grib2"))
+            assert len(it.extractfile(tinfo).read()) == arome_grib2.stat().st_size
+            # a miss scans the whole index and is a lookup too
+            assert list(it.get_members_by_name("missing.grib2")) == []
+            stats = it.stats()
+
+    assert stats["index"]["payload_bytes"] == no_files * arome_grib2.stat().st_size
+    assert stats["index"]["index_bytes"] > 0
+    assert stats["counters"]["index_entries"] == no_files
+    assert index_load_reads > 0
+    assert stats["counters"]["members_matched"] == 1
+    assert stats["counters"]["members_scanned"] == 2 + no_files
+    assert stats["derived"]["members_scanned_per_match"] == 2 + no_files
+    assert stats["counters"]["bytes_read"] >= arome_grib2.stat().st_size
+    assert stats["counters"]["seeks"] > 0
+    assert stats["latency"]["lookup"]["count"] == 2
+    assert sum(stats["latency"]["extractfile_open"]["buckets"].values()) == 1
+    assert observed[:4] == ["index_load", "lookup", "extractfile_open", "lookup"]
+    assert observed[-1] == "close"
+
+
+def test_stats_threads():
+    """
+    Counters and histograms do not lose concurrent updates
+    """
+    stats = indexedtar.IndexedTarStats()
+
+    def update():
+        for _ in range(10000):
+            stats.incr("bytes_read", 2)
+            stats.observe("read", 1e-6)
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert stats.as_dict()["counters"]["bytes_read"] == 8 * 10000 * 2
+    assert stats.as_dict()["latency"]["read"]["count"] == 8 * 10000
+
+
+def test_copy_member_to(ithelper, arome_grib2: Path):
+    """
+    Payload copies to files, raw fds, sockets and
+    in memory file objects
+    """
+    expected = arome_grib2.read_bytes()
+    with ithelper.build_indexedtarfile(2) as itar_path:
+        with IndexedTar(itar_path) as it, tempfile.TemporaryDirectory() as td:
+            with open(Path(td) / "out", "wb") as dst:
+                dst.write(b"head")
+                assert it.copy_member_to("1_arome.grib2", dst) == len(expected)
+                dst.write(b"tail")
+            assert (Path(td) / "out").read_bytes() == b"head" + expected + b"tail"
+
+            fd = os.open(Path(td) / "raw", os.O_WRONLY | os.O_CREAT)
+            try:
+                it.copy_member_to(next(it.get_members_by_name("0_arome.grib2")), fd)
+            finally:
+                os.close(fd)
+            assert (Path(td) / "raw").read_bytes() == expected
+
+            # O_APPEND destinations
+            with open(Path(td) / "raw", "ab") as dst:
+                it.copy_member_to("1_arome.grib2", dst)
+            fd = os.open(Path(td) / "raw", os.O_WRONLY | os.O_APPEND)
+            try:
+                it.copy_member_to("1_arome.grib2", fd)
+            finally:
+                os.close(fd)
+            assert (Path(td) / "raw").read_bytes() == expected * 3
+
+            buf = io.BytesIO()
+            it.copy_member_to("0_arome.grib2", buf)
+            assert buf.getvalue() == expected
+
+            left, right = socket.socketpair()
+            with left, right:
+                sender = threading.Thread(
+                    target=it.copy_member_to, args=("1_arome.grib2", left)
+                )
+                sender.start()
+                received = bytearray()
+                while len(received) < len(expected):
+                    received += right.recv(1024 ** 2)
+                sender.join()
+            assert bytes(received) == expected
+
+            with pytest.raises(IndexedTarException):
+                it.copy_member_to("missing.grib2", buf)
+
+            # a TarInfo pointing past the end of the archive is rejected
+            outside = tarfile.TarInfo("outside.grib2")
+            outside.offset_data = itar_path.stat().st_size
+            outside.size = 1
+            with pytest.raises(IndexedTarException):
+                it.copy_member_to(outside, buf)
+
+            # a bad destination descriptor is an error, not a fallback
+            fd = os.open(Path(td) / "raw", os.O_RDONLY)
+            try:
+                with pytest.raises(OSError):
+                    it.copy_member_to("0_arome.grib2", fd)
+            finally:
+                os.close(fd)
+
+
+def test_extract_uses_copy_range(ithelper, arome_grib2: Path):
+    """
+    extract_members, hence itar x, copies payloads
+    with copy_range, and stats account for the copied bytes
+    """
+    no_files: int = 2
+    with ithelper.build_indexedtarfile(no_files) as itar_path:
+        with IndexedTar(
+            itar_path, stats=True
+        ) as it, tempfile.TemporaryDirectory() as td:
+            with mock.patch(
+                "indexedtar.copy_range", wraps=indexedtar.copy_range
+            ) as copy_range:
+                it.extract_members(it.get_members_fnmatching("*"), path=td)
+            assert copy_range.call_count == no_files
+            for i in range(no_files):
+                assert (
+                    Path(td) / f"{i}_arome.grib2"
+                ).read_bytes() == arome_grib2.read_bytes()
+            assert (
+                it.stats()["counters"]["bytes_read"]
+                >= no_files * arome_grib2.stat().st_size
+            )
+
+
+def test_merge(ithelper, arome_grib2: Path, arpege_grib2: Path):
+    """
+    Merging archives by range copy and index rebasing
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        with IndexedTar(tdp / "day1.tar", "x:") as it:
+            it.add(arome_grib2, arcname="a.grib2")
+            it.add(arpege_grib2, arcname="b.grib2")
+
+        # an appended archive holds a stale index in its members region
+        with IndexedTar(tdp / "day2.tar", "x:") as it:
+            it.add(arpege_grib2, arcname="a.grib2")
+        with IndexedTar(tdp / "day2.tar", "a:") as it:
+            it.add(arome_grib2, arcname="c.grib2")
+
+        # no tar header of the sources is parsed
+        with mock.patch.object(
+            IndexedTar, "_read_tarinfo", side_effect=AssertionError
+        ) as read_tarinfo:
+            IndexedTar.merge([tdp / "day1.tar", tdp / "day2.tar"], tdp / "month.tar")
+        assert read_tarinfo.call_count == 0
+        IndexedTar.merge(
+            [tdp / "day1.tar", tdp / "day2.tar"], tdp / "dedupe.tar", dedupe=True
+        )
+
+        with IndexedTar(tdp / "month.tar") as it:
+            assert len(list(it.get_members_fnmatching("*"))) == 4
+            for i, (name, expected) in enumerate(
+                (
+                    ("a.grib2", arome_grib2),
+                    ("b.grib2", arpege_grib2),
+                    ("a.grib2", arpege_grib2),
+                    ("c.grib2", arome_grib2),
+                )
+            ):
+                tinfo = it.getmember_at_index(i)
+                assert tinfo.name == name
+                assert it.extractfile(tinfo).read() == expected.read_bytes()
+
+        with IndexedTar(tdp / "dedupe.tar") as it:
+            assert sorted(x.name for x in it.get_members_fnmatching("*")) == [
+                "a.grib2",
+                "b.grib2",
+                "c.grib2",
+            ]
+            buf = io.BytesIO()
+            it.copy_member_to("a.grib2", buf)
+            assert buf.getvalue() == arpege_grib2.read_bytes()
+
+        # the merged archive is still a plain tar
+        with tarfile.TarFile(tdp / "month.tar", "r") as tf:
+            names = [x.name for x in tf.getmembers()]
+        assert names == [
+            IndexedTar._header_filename,
+            "a.grib2",
+            "b.grib2",
+            "a.grib2",
+            IndexedTar._index_filename,
+            "c.grib2",
+            IndexedTar._index_filename,
+        ]
+
+
+def test_add_files_parallel(data_dir, arome_grib2: Path, arpege_grib2: Path):
+    """
+    Parallel creation packs segments in worker processes
+    and yields a single standard IndexedTar
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        src_dir = tdp / "src"
+        src_dir.mkdir()
+        sources = dict()
+        for i in range(7):
+            sources[src_dir / f"{i}.grib2"] = arpege_grib2 if i % 2 else arome_grib2
+            (src_dir / f"{i}.grib2").write_bytes(
+                sources[src_dir / f"{i}.grib2"].read_bytes()
+            )
+
+        with IndexedTar(tdp / "parallel.tar", "x:") as it:
+            it.add_dir(src_dir, jobs=3)
+        with IndexedTar(tdp / "parallel.tar", "a:") as it:
+            it.add_files([arpege_grib2, arome_grib2], jobs=2)
+
+        with IndexedTar(tdp / "parallel.tar") as it:
+            assert len(list(it.get_members_fnmatching("*"))) == 9
+            for src, expected in sources.items():
+                tinfo = [x for x in it.get_members_fnmatching(f"*/{src.name}")][-1]
+                assert it.extractfile(tinfo).read() == expected.read_bytes()
+
+        with tarfile.TarFile(tdp / "parallel.tar", "r") as tf:
+            names = [x.name for x in tf.getmembers()]
+        assert len(names) == 9 + 3
+        assert sorted(Path(x).name for x in names[1:8]) == sorted(
+            x.name for x in sources
+        )
+
+
+def test_entries_fnmatching(ithelper, arpege_grib2: Path):
+    """
+    Listing from the index alone, in index order
+    """
+    no_files: int = 3
+    with ithelper.build_indexedtarfile(no_files) as itar_path:
+        with IndexedTar(itar_path, "a:") as it:
+            it.add(arpege_grib2, arcname="1_arome.grib2")
+
+        with IndexedTar(itar_path, stats=True) as it:
+            reads = it.stats()["counters"]["reads"]
+            entries = list(it.get_entries_fnmatching("*"))
+            assert [x.name for x in entries] == [
+                "0_arome.grib2",
+                "1_arome.grib2",
+                "2_arome.grib2",
+                "1_arome.grib2",
+            ]
+            assert entries[-1].size == arpege_grib2.stat().st_size
+            assert [
+                x.name for x in it.get_entries_fnmatching("*", latest_only=True)
+            ] == ["0_arome.grib2", "2_arome.grib2", "1_arome.grib2"]
+            assert [x.data_offset for x in it.get_entries_fnmatching("1_*", True)] == [
+                entries[3].data_offset,
+                entries[1].data_offset,
+            ]
+            # no header I/O
+            assert it.stats()["counters"]["reads"] == reads
+
+            # members are listed in index order too, the latest one wins
+            assert [x.name for x in it.get_members_fnmatching("*")] == [
+                x.name for x in entries
+            ]
+            assert it.extractfile("1_arome.grib2").read() == arpege_grib2.read_bytes()
+
+
+def test_dedupe_content(arome_grib2: Path, arpege_grib2: Path):
+    """
+    Identical payloads are stored once, repeats as
+    hard link members pointing at the original payload
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        with IndexedTar(tdp / "dedupe.tar", "x:", dedupe_content=True) as it:
+            for i in range(3):
+                it.add(arome_grib2, arcname=f"{i}_arome.grib2")
+            it.add(arpege_grib2, arcname="arpege.grib2")
+            it.add(arpege_grib2, arcname="arpege_copy.grib2")
+
+        assert (tdp / "dedupe.tar").stat().st_size < 2 * arome_grib2.stat().st_size
+
+        with tarfile.TarFile(tdp / "dedupe.tar", "r") as tf:
+            assert [(x.name, x.linkname) for x in tf.getmembers() if x.islnk()] == [
+                ("1_arome.grib2", "0_arome.grib2"),
+                ("2_arome.grib2", "0_arome.grib2"),
+                ("arpege_copy.grib2", "arpege.grib2"),
+            ]
+            # plain tar tools extract the links
+            tf.extractall(tdp / "tar_out")
+        assert (tdp / "tar_out" / "2_arome.grib2").read_bytes() == (
+            arome_grib2.read_bytes()
+        )
+
+        with IndexedTar(tdp / "dedupe.tar") as it:
+            for name, expected in (
+                ("1_arome.grib2", arome_grib2),
+                ("arpege_copy.grib2", arpege_grib2),
+            ):
+                assert it.extractfile(name).read() == expected.read_bytes()
+                buf = io.BytesIO()
+                it.copy_member_to(name, buf)
+                assert buf.getvalue() == expected.read_bytes()
+                buf = io.BytesIO()
+                it.copy_member_to(next(it.get_members_by_name(name)), buf)
+                assert buf.getvalue() == expected.read_bytes()
+
+            # extracting a link alone resolves its target through the index
+            it.extract_members(
+                it.get_members_by_name("2_arome.grib2"), path=tdp / "out"
+            )
+            assert (tdp / "out" / "2_arome.grib2").read_bytes() == (
+                arome_grib2.read_bytes()
+            )
+
+        # once a name is shadowed, no new link points to it
+        with IndexedTar(tdp / "shadow.tar", "x:", dedupe_content=True) as it:
+            it.add(arome_grib2, arcname="a.grib2")
+            it.add(arpege_grib2, arcname="a.grib2")
+            it.add(arome_grib2, arcname="b.grib2")
+
+        with IndexedTar(tdp / "shadow.tar") as it:
+            assert [x.islnk() for x in it.get_members_fnmatching("*")] == [
+                False,
+                False,
+                False,
+            ]
+            assert it.extractfile("b.grib2").read() == arome_grib2.read_bytes()
+
+
+@pytest.mark.parametrize("vectorized", (True, False))
+def test_query(arome_grib2: Path, arpege_grib2: Path, vectorized: bool):
+    """
+    Range queries on the mtime and size columns
+    """
+    with tempfile.TemporaryDirectory() as td, mock.patch.object(
+        indexedtar, "numpy", indexedtar.numpy if vectorized else None
+    ):
+        tdp = Path(td)
+        for i, src in enumerate((arome_grib2, arpege_grib2, arome_grib2)):
+            (tdp / f"run{i}.grib2").write_bytes(src.read_bytes())
+            os.utime(tdp / f"run{i}.grib2", (1000 * (i + 1), 1000 * (i + 1)))
+
+        with IndexedTar(tdp / "columns.tar", "x:", columns=True) as it:
+            for i in range(2):
+                it.add(tdp / f"run{i}.grib2", arcname=f"a/run{i}.grib2")
+        with IndexedTar(tdp / "legacy.tar", "x:") as it:
+            for i in range(3):
+                it.add(tdp / f"run{i}.grib2", arcname=f"b/run{i}.grib2")
+        # columns are kept when appending
+        with IndexedTar(tdp / "columns.tar", "a:") as it:
+            it.add(tdp / "run2.grib2", arcname="b/run2.grib2")
+
+        big = arome_grib2.stat().st_size
+        for archive, prefix in (("columns.tar", "a/"), ("legacy.tar", "b/")):
+            with IndexedTar(tdp / archive, stats=True) as it:
+                reads = it.stats()["counters"]["reads"]
+                assert it.stats()["index"]["columns"] == (archive == "columns.tar")
+                assert [x.name for x in it.query(mtime_range=(1500, 3000))] == [
+                    f"{prefix}run1.grib2"
+                ]
+                assert [x.name for x in it.query(mtime_range=(2000, None))] == [
+                    f"{prefix}run1.grib2",
+                    "b/run2.grib2",
+                ]
+                assert [x.size for x in it.query(size_range=(big, None))] == [big, big]
+                assert [
+                    x.name for x in it.query(size_range=(None, big), name_prefix="a/")
+                ] == ([f"{prefix}run1.grib2"] if prefix == "a/" else [])
+                assert len(it.query()) == 3
+                if archive == "columns.tar":
+                    # one read for the mtime column, one for the size column
+                    assert it.stats()["counters"]["reads"] == reads + 2
+                else:
+                    # the legacy archive falls back to reading tar headers
+                    assert it.stats()["counters"]["reads"] > reads + 2
+
+        with tarfile.TarFile(tdp / "columns.tar", "r") as tf:
+            assert IndexedTar._columns_filename in tf.getnames()
+
+
+def test_contains(ithelper, arome_grib2: Path, arpege_grib2: Path):
+    """
+    Negative lookups answered by the membership filter
+    without reading the index
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        with IndexedTar(tdp / "filter.tar", "x:", membership_filter=True) as it:
+            for i in range(50):
+                it.add(arpege_grib2, arcname=f"{i}_arpege.grib2")
+        # the filter is kept when appending
+        with IndexedTar(tdp / "filter.tar", "a:") as it:
+            it.add(arome_grib2, arcname="arome.grib2")
+
+        with IndexedTar(tdp / "filter.tar", stats=True) as it:
+            assert not any(it.contains(f"{i}_arome.grib2") for i in range(10))
+            assert not it.contains(IndexedTar._index_filename)
+            # one read of the filter, the index was not loaded
+            assert it._index_entries is None
+            assert it._stats.counters["filter_negatives"] == 10
+            assert "index_load" not in it._stats.latencies
+
+            assert it.contains("arome.grib2")
+            assert all(it.contains(f"{i}_arpege.grib2") for i in range(50))
+
+        with ithelper.build_indexedtarfile(2) as itar_path:
+            with IndexedTar(itar_path) as it:
+                assert it.contains("1_arome.grib2")
+                assert not it.contains("2_arome.grib2")
+
+
+def test_align(arome_grib2: Path, arpege_grib2: Path):
+    """
+    Aligned member data offsets, the archive
+    staying readable by tar tools
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        with IndexedTar(tdp / "aligned.tar", "x:", align=4096) as it:
+            it.add(arome_grib2, arcname="arome.grib2")
+            it.add(arpege_grib2, arcname=f"{'long_name' * 20}.grib2")
+            it.add(arpege_grib2, arcname="arpege.grib2")
+        with IndexedTar(tdp / "aligned.tar", "a:", align=8192) as it:
+            it.add(arome_grib2, arcname="appended.grib2")
+
+        with IndexedTar(tdp / "aligned.tar") as it:
+            entries = list(it.get_entries_fnmatching("*"))
+            assert [x.data_offset % 4096 for x in entries] == [0, 0, 0, 0]
+            assert entries[-1].data_offset % 8192 == 0
+            for entry in entries:
+                tinfo = it._read_tarinfo(entry.tinfo_offset)
+                assert tinfo.offset_data == entry.data_offset
+                expected = arpege_grib2 if entry.size < 1024 ** 2 else arome_grib2
+                view = it.mmap_member(entry.name)
+                assert bytes(view) == expected.read_bytes()
+                view.release()
+
+        with tarfile.TarFile(tdp / "aligned.tar", "r") as tf:
+            tf.extractall(tdp / "out")
+        assert (tdp / "out" / "arpege.grib2").read_bytes() == arpege_grib2.read_bytes()
+
+        with pytest.raises(IndexedTarException):
+            IndexedTar(tdp / "misaligned.tar", "x:", align=1000)
+
+
+def test_replace(arome_grib2: Path, arpege_grib2: Path):
+    """
+    In place replacement of payloads fitting their blocks
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        itar_path = tdp / "replace.tar"
+        other = tdp / "other.grib2"
+        other.write_bytes(arpege_grib2.read_bytes() + b"other")
+        with IndexedTar(itar_path, "x:", columns=True, dedupe_content=True) as it:
+            it.add(arpege_grib2, arcname="arpege.grib2")
+            it.add(arpege_grib2, arcname="arpege_copy.grib2")
+            it.add(arome_grib2, arcname=f"{'long_name' * 20}.grib2")
+            it.add(other, arcname="other.grib2")
+
+        size = itar_path.stat().st_size
+        arpege = arpege_grib2.read_bytes()
+        smaller = arpege[: len(arpege) - 7]
+        # fits within the last 512 bytes block
+        larger = other.read_bytes() + bytes(-other.stat().st_size % 512)
+
+        with IndexedTar(itar_path, "a:") as it:
+            it.replace(f"{'long_name' * 20}.grib2", b"corrected")
+            with pytest.raises(IndexedTarException):
+                it.replace("other.grib2", larger + bytes(1))
+            # payloads shared by hard links cannot be replaced
+            with pytest.raises(IndexedTarException):
+                it.replace("arpege.grib2", smaller)
+            with pytest.raises(IndexedTarException):
+                it.replace("arpege_copy.grib2", smaller)
+            with pytest.raises(IndexedTarException):
+                it.replace("missing.grib2", smaller)
+
+        # the archive did not grow: the index was rewritten in place
+        assert itar_path.stat().st_size == size
+
+        with IndexedTar(itar_path, "a:") as it:
+            it.replace("other.grib2", larger)
+        assert itar_path.stat().st_size == size
+
+        with IndexedTar(itar_path) as it:
+            assert it.extractfile(f"{'long_name' * 20}.grib2").read() == b"corrected"
+            assert it.extractfile("other.grib2").read() == larger
+            assert it.extractfile("arpege_copy.grib2").read() == arpege
+            assert [x.size for x in it.query(size_range=(None, 100))] == [9]
+
+        with tarfile.TarFile(itar_path, "r") as tf:
+            # shrunk payloads leave the archive walkable
+            assert [x.name for x in tf.getmembers()][-2:] == [
+                "_tar_columns.bin",
+                "_tar_index.json",
+            ]
+            assert tf.extractfile("other.grib2").read() == larger
+            assert tf.extractfile(f"{'long_name' * 20}.grib2").read() == b"corrected"
+
+        with IndexedTar(itar_path, "r:") as it:
+            with pytest.raises(IndexedTarException):
+                it.replace("other.grib2", b"")
+
+
+@pytest.mark.parametrize("compression", ["", "gz"])
+@pytest.mark.parametrize("dedupe_content", [False, True])
+def test_from_tar_stream(
+    arome_grib2: Path, arpege_grib2: Path, compression: str, dedupe_content: bool
+):
+    """
+    Conversion of a plain tar stream, read once
+    """
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode=f"w|{compression}") as tf:
+        directory = tarfile.TarInfo("grib")
+        directory.type = tarfile.DIRTYPE
+        tf.addfile(directory)
+        tf.add(arpege_grib2, arcname="grib/arpege.grib2")
+        tf.add(arome_grib2, arcname="grib/arome.grib2")
+        tf.add(arpege_grib2, arcname="grib/arpege_copy.grib2")
+        link = tarfile.TarInfo("grib/arome_link.grib2")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "grib/arome.grib2"
+        tf.addfile(link)
+        symlink = tarfile.TarInfo("grib/latest.grib2")
+        symlink.type = tarfile.SYMTYPE
+        symlink.linkname = "arome.grib2"
+        tf.addfile(symlink)
+
+    with tempfile.TemporaryDirectory() as td:
+        itar_path = Path(td) / "converted.tar"
+        stream.seek(0)
+        IndexedTar.from_tar_stream(stream, itar_path, dedupe_content=dedupe_content)
+
+        with IndexedTar(itar_path) as it:
+            # only regular members and hard links to them are indexed
+            assert [x[0] for x in it._index] == [
+                "grib/arpege.grib2",
+                "grib/arome.grib2",
+                "grib/arpege_copy.grib2",
+                "grib/arome_link.grib2",
+            ]
+            assert it._index[3][2:] == it._index[1][2:]
+            assert (it._index[2][2] == it._index[0][2]) == dedupe_content
+            assert it.extractfile("grib/arome_link.grib2").read() == (
+                arome_grib2.read_bytes()
+            )
+            assert it.extractfile("grib/arpege_copy.grib2").read() == (
+                arpege_grib2.read_bytes()
+            )
+
+            # converting an IndexedTar stream skips its internal members
+            with open(itar_path, "rb") as src:
+                IndexedTar.from_tar_stream(src, Path(td) / "again.tar")
+            with IndexedTar(Path(td) / "again.tar") as again:
+                assert [x[0] for x in again._index] == [x[0] for x in it._index]
+
+        with tarfile.open(itar_path) as tf:
+            assert tf.getmember("grib/latest.grib2").issym()
+            assert tf.getmember("grib").isdir()
+
+
+def test_read_scheduler():
+    """
+    Queued reads are dispatched in elevator order, adjacent ones merged
+    """
+    payload = os.urandom(8192)
+    with tempfile.TemporaryFile() as f:
+        f.write(payload)
+        f.flush()
+        scheduler = indexedtar.ReadScheduler(f, queue_depth=1)
+        with mock.patch("os.pread", wraps=os.pread) as pread, scheduler:
+            # queue all the requests before the worker gets any
+            with scheduler._condition:
+                scheduler._head = 2000
+                requests = [(1000, 100), (0, 100), (5000, 100), (3000, 100), (100, 100)]
+                futures = [scheduler.submit(*x) for x in requests]
+            results = [x.result() for x in futures]
+
+        assert [x.args[1:] for x in pread.call_args_list] == [
+            (100, 3000),
+            (100, 5000),
+            (200, 0),
+            (100, 1000),
+        ]
+        assert results == [payload[x:][:size] for x, size in requests]
+
+        # reads past the end of the file
+        with indexedtar.ReadScheduler(f) as scheduler:
+            with pytest.raises(tarfile.ReadError):
+                scheduler.submit(8000, 1000).result()
+
+
+@pytest.mark.parametrize("read_queue_depth", [0, 4])
+def test_read_member(ithelper, arome_grib2: Path, read_queue_depth: int):
+    """
+    Concurrent member reads, scheduled or not
+    """
+    with ithelper.build_indexedtarfile(8) as itar_path:
+        with IndexedTar(
+            itar_path, stats=True, read_queue_depth=read_queue_depth
+        ) as it, ThreadPoolExecutor(8) as executor:
+            names = [f"{i}_arome.grib2" for i in range(8)]
+            futures = list(executor.map(it.read_member, names))
+            expected = arome_grib2.read_bytes()
+            assert all(x.result() == expected for x in futures)
+            assert it.read_member(names[0], 10, 20).result() == expected[10:30]
+            assert it.stats()["counters"]["bytes_read"] >= 8 * len(expected)
+            with pytest.raises(IndexedTarException):
+                it.read_member(names[0], 10, len(expected))
+
+
+def _short_pread(fd: int, size: int, offset: int) -> bytes:
+    """
+    os.pread returning at most 64 KiB per call, as Linux
+    does past 0x7ffff000 bytes
+    """
+    return _real_pread(fd, min(size, 64 * 1024), offset)
+
+
+_real_pread = os.pread
+
+
+@pytest.mark.parametrize("read_queue_depth", [0, 2])
+def test_read_member_short_reads(ithelper, arome_grib2: Path, read_queue_depth: int):
+    """
+    Short preads are looped over
+    """
+    with ithelper.build_indexedtarfile(2) as itar_path, mock.patch(
+        "os.pread", side_effect=_short_pread
+    ):
+        with IndexedTar(itar_path, read_queue_depth=read_queue_depth) as it:
+            futures = [it.read_member(f"{i}_arome.grib2") for i in range(2)]
+            assert all(x.result() == arome_grib2.read_bytes() for x in futures)
+
+
+def test_iter_all(arome_grib2: Path, arpege_grib2: Path):
+    """
+    Full scans in data offset order with read-ahead
+    """
+    with tempfile.TemporaryDirectory() as td:
+        itar_path = Path(td) / "scan.tar"
+        with IndexedTar(itar_path, "x:", dedupe_content=True) as it:
+            it.add(arome_grib2, arcname="arome.grib2")
+            it.add(arpege_grib2, arcname="arpege.grib2")
+            it.add(arome_grib2, arcname="arome_copy.grib2")
+            it.add(arpege_grib2, arcname="arome.grib2")
+
+        with IndexedTar(itar_path, stats=True) as it:
+            payloads = {
+                "arome.grib2": arome_grib2.read_bytes(),
+                "arpege.grib2": arpege_grib2.read_bytes(),
+            }
+            payloads["arome_copy.grib2"] = payloads["arome.grib2"]
+            for chunk_size in (1, 1024 ** 2, 1024 ** 3):
+                scanned = list(it.iter_all(chunk_size=chunk_size))
+                assert [x.data_offset for x, _ in scanned] == sorted(
+                    x[2] for x in it._index
+                )
+                assert [x.name for x, _ in scanned] == [
+                    "arome.grib2",
+                    "arome_copy.grib2",
+                    "arpege.grib2",
+                    "arome.grib2",
+                ]
+                assert [bytes(x) for _, x in scanned[:3]] == [
+                    payloads[x.name] for x, _ in scanned[:3]
+                ]
+                assert scanned[3][1] == payloads["arpege.grib2"]
+
+            assert [x.name for x, _ in it.iter_all(latest_only=True)] == [
+                "arome_copy.grib2",
+                "arpege.grib2",
+                "arome.grib2",
+            ]
+            assert all(x is None for _, x in it.iter_all(with_data=False))
+
+            with mock.patch("os.pread", side_effect=_short_pread):
+                assert [bytes(x) for _, x in it.iter_all(latest_only=True)] == [
+                    payloads["arome.grib2"],
+                    payloads["arpege.grib2"],
+                    payloads["arpege.grib2"],
+                ]
+
+            if hasattr(os, "posix_fadvise"):
+                with mock.patch("os.posix_fadvise") as fadvise:
+                    list(it.iter_all())
+                assert [x.args[3] for x in fadvise.call_args_list] == [
+                    os.POSIX_FADV_SEQUENTIAL,
+                    os.POSIX_FADV_NORMAL,
+                ]
+
+            # stopping early stops the read-ahead thread
+            threads = threading.active_count()
+            for _ in it.iter_all(chunk_size=1):
+                break
+            assert threading.active_count() == threads
+            assert it.stats()["counters"]["bytes_read"] > 0
+
+
+@pytest.mark.skipif(shutil.which("tar") is None, reason="requires a tar command")
+@pytest.mark.parametrize("tar_format", ["posix", "gnu"])
+def test_from_tar_stream_sparse(tar_format: str):
+    """
+    Sparse members of a tar stream are stored expanded as regular members
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        src = tdp / "src"
+        src.mkdir()
+        with open(src / "sparse.bin", "wb") as f:
+            f.seek(1024 ** 2)
+            f.write(b"data")
+            f.truncate(3 * 1024 ** 2)
+        expected = (src / "sparse.bin").read_bytes()
+
+        stream = subprocess.run(
+            ["tar", "cS", f"--format={tar_format}", "-C", str(src), "sparse.bin"],
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        with tarfile.open(fileobj=io.BytesIO(stream)) as tf:
+            assert tf.getmember("sparse.bin").issparse()
+
+        itar_path = tdp / "converted.tar"
+        IndexedTar.from_tar_stream(io.BytesIO(stream), itar_path)
+        with IndexedTar(itar_path) as it:
+            assert [x[0] for x in it._index] == ["sparse.bin"]
+            assert it.extractfile("sparse.bin").read() == expected
+
+        out = tdp / "out"
+        out.mkdir()
+        subprocess.run(["tar", "xf", str(itar_path), "-C", str(out)], check=True)
+        assert (out / "sparse.bin").read_bytes() == expected
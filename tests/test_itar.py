@@ -1,13 +1,14 @@
 """
 unit tests for our 'itar' cli
 """
+import json
 import tempfile
 from pathlib import Path
 import pytest
 from indexedtar.itar import main
 
 
-def test_itar_cli(arpege_grib2: Path, arome_grib2: Path):
+def test_itar_cli(arpege_grib2: Path, arome_grib2: Path, capsys):
     with tempfile.TemporaryDirectory() as td:
         tdp = Path(td)
         args = list()
@@ -59,3 +60,64 @@ def test_itar_cli(arpege_grib2: Path, arome_grib2: Path):
         args.append("--fnmatch_filter")
         args.append("*arome*")
         main(args)
+        assert capsys.readouterr().out.endswith(f"{arome_grib2.name}\n")
+
+        main(["l", str(tdp / "test.tar"), "--count"])
+        assert capsys.readouterr().out == "2\n"
+
+        main(["l", str(tdp / "test.tar"), "--json", "--latest-only"])
+        listing = [json.loads(x) for x in capsys.readouterr().out.splitlines()]
+        assert [x["name"] for x in listing] == [
+            str(arpege_grib2).lstrip("/"),
+            str(arome_grib2).lstrip("/"),
+        ]
+        assert listing[0]["size"] == arpege_grib2.stat().st_size
+
+        main(["l", str(tdp / "test.tar"), "--long"])
+        size, tinfo_offset, data_offset, name = capsys.readouterr().out.split()[:4]
+        assert (int(size), int(data_offset), name) == (
+            listing[0]["size"],
+            listing[0]["data_offset"],
+            listing[0]["name"],
+        )
+
+        # index shape and load statistics
+        main(["stats", str(tdp / "test.tar")])
+
+        # merging the archive with itself twice
+        main(
+            [
+                "merge",
+                str(tdp / "merged.tar"),
+                "--target",
+                str(tdp / "test.tar"),
+                "--target",
+                str(tdp / "test.tar"),
+                "--dedupe",
+            ]
+        )
+        main(["stats", str(tdp / "merged.tar")])
+
+        # parallel creation
+        main(
+            [
+                "c",
+                str(tdp / "parallel.tar"),
+                "--target",
+                str(arpege_grib2.parent),
+                "--jobs",
+                "2",
+            ]
+        )
+        with tempfile.TemporaryDirectory() as dst:
+            main(["x", str(tdp / "parallel.tar"), "--output_dir", dst])
+            assert len(list(Path(dst).rglob("*.grib2"))) == 2
+
+        # conversion of a plain tar, an IndexedTar is a plain tar too
+        main(["convert", str(tdp / "converted.tar"), "--target", str(tdp / "test.tar")])
+        capsys.readouterr()
+        main(["l", str(tdp / "converted.tar")])
+        assert capsys.readouterr().out.splitlines() == [
+            str(arpege_grib2).lstrip("/"),
+            str(arome_grib2).lstrip("/"),
+        ]
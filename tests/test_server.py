@@ -0,0 +1,132 @@
+"""
+unit tests for our HTTP member server
+"""
+import http.client
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from indexedtar import IndexedTar
+from indexedtar.server import IndexedTarHTTPServer
+
+
+@contextmanager
+def serving(archives: list, **kwargs):
+    """
+    Runs an IndexedTarHTTPServer on a free port,
+    yields a connection factory
+    """
+    kwargs.setdefault("threads", 4)
+    server = IndexedTarHTTPServer(("127.0.0.1", 0), archives, **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield lambda: http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_serve(arome_grib2: Path, arpege_grib2: Path):
+    with tempfile.TemporaryDirectory() as td:
+        tdp = Path(td)
+        with IndexedTar(tdp / "first.tar", "x:") as it:
+            it.add(arome_grib2, arcname="dir/arome file.grib2")
+            it.add(arpege_grib2, arcname="shared.grib2")
+        with IndexedTar(tdp / "second.tar", "x:") as it:
+            it.add(arome_grib2, arcname="shared.grib2")
+            it.add(arpege_grib2, arcname="arpege.grib2")
+
+        arome, arpege = arome_grib2.read_bytes(), arpege_grib2.read_bytes()
+        with serving([tdp / "first.tar", tdp / "second.tar"]) as connect:
+            conn = connect()
+
+            # keep-alive connection serving several members
+            for path, expected in (
+                ("/dir/arome%20file.grib2", arome),
+                ("/shared.grib2", arpege),
+                ("/arpege.grib2", arpege),
+            ):
+                conn.request("GET", path)
+                response = conn.getresponse()
+                assert response.status == 200
+                assert response.getheader("Accept-Ranges") == "bytes"
+                assert response.read() == expected
+
+            for byte_range, status, expected in (
+                ("bytes=10-19", 206, arpege[10:20]),
+                ("bytes=-5", 206, arpege[-5:]),
+                (f"bytes={len(arpege) - 3}-", 206, arpege[-3:]),
+                (f"bytes=0-{10 * len(arpege)}", 206, arpege),
+                (f"bytes={len(arpege)}-", 416, b""),
+                ("bytes=5-2", 416, b""),
+                ("lines=0-1", 416, b""),
+            ):
+                conn.request("GET", "/arpege.grib2", headers={"Range": byte_range})
+                response = conn.getresponse()
+                assert response.status == status
+                assert response.read() == expected
+
+            conn.request("HEAD", "/arpege.grib2")
+            response = conn.getresponse()
+            assert response.status == 200
+            assert int(response.getheader("Content-Length")) == len(arpege)
+            assert response.read() == b""
+
+            conn.request("GET", "/missing.grib2")
+            response = conn.getresponse()
+            assert response.status == 404
+            response.read()
+
+            conn.request("GET", "/?fnmatch=*.grib2")
+            response = conn.getresponse()
+            assert response.getheader("Content-Type") == "application/x-ndjson"
+            listing = [json.loads(x) for x in response.read().splitlines()]
+            assert [(Path(x["archive"]).name, x["name"]) for x in listing] == [
+                ("first.tar", "dir/arome file.grib2"),
+                ("first.tar", "shared.grib2"),
+                ("second.tar", "shared.grib2"),
+                ("second.tar", "arpege.grib2"),
+            ]
+            conn.close()
+
+            # concurrent clients
+            results = [None] * 8
+
+            def fetch(i):
+                c = connect()
+                c.request("GET", "/dir/arome%20file.grib2")
+                results[i] = c.getresponse().read()
+                c.close()
+
+            threads = [threading.Thread(target=fetch, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert all(x == arome for x in results)
+
+
+def test_idle_connections(arpege_grib2: Path):
+    """
+    Idle keep-alive clients do not starve the thread pool
+    """
+    with tempfile.TemporaryDirectory() as td:
+        itar_path = Path(td) / "idle.tar"
+        with IndexedTar(itar_path, "x:") as it:
+            it.add(arpege_grib2, arcname="arpege.grib2")
+
+        with serving([itar_path], threads=2, idle_timeout=0.5) as connect:
+            idle = [connect() for _ in range(2)]
+            for conn in idle:
+                conn.request("GET", "/arpege.grib2")
+                conn.getresponse().read()
+
+            conn = connect()
+            conn.timeout = 10
+            conn.request("GET", "/arpege.grib2")
+            assert conn.getresponse().read() == arpege_grib2.read_bytes()
+            for c in idle + [conn]:
+                c.close()